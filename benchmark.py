@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks for the hot paths of C-Snake.
+
+Every workload is run on synthetic data; its throughput (elements and MB of
+generated code per second) and peak memory are reported and can be saved as
+JSON, to be compared against the results of another version:
+
+    python benchmark.py --output new.json --compare old.json
+
+The time it takes to import csnake (in a fresh interpreter) is measured too;
+with --import-budget, the run fails if it exceeds the budget or if importing
+csnake imports NumPy. So is the memory taken by each object of the object
+model (constructs and enum values).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import csnake
+
+WORKLOADS = {}
+
+
+def workload(name):
+    """Register a workload.
+
+    A workload takes the scale (number of elements) and returns the actual
+    number of elements and a function that runs it, returning the generated
+    code.
+    """
+
+    def register(func):
+        WORKLOADS[name] = func
+
+        return func
+
+    return register
+
+
+def square(scale):
+    """Return the side of a square with about scale elements."""
+
+    return max(int(scale**0.5), 1)
+
+
+def cube(scale):
+    """Return the side of a cube with about scale elements."""
+
+    return max(int(round(scale**(1 / 3))), 1)
+
+
+@workload('shape-list-nd')
+def shape_list_nd(scale):
+    side = cube(scale)
+    value = np.arange(side**3).reshape(side, side, side).tolist()
+
+    def run():
+        for _ in range(1000):
+            csnake.shape(value)
+
+        return ''
+
+    return 1000, run
+
+
+@workload('array-info-list-nd')
+def array_info_list_nd(scale):
+    side = cube(scale)
+    value = np.arange(side**3).reshape(side, side, side).tolist()
+
+    def run():
+        csnake.array_info(value)
+
+        return ''
+
+    return side**3, run
+
+
+@workload('array-list-1d')
+def array_list_1d(scale):
+    var = csnake.Variable('x', 'int', value=list(range(scale)))
+
+    return scale, var.initialization
+
+
+@workload('array-list-1d-formatted')
+def array_list_1d_formatted(scale):
+    var = csnake.Variable(
+        'x', 'uint32_t', value=list(range(scale)), value_opts='0x{0:08X}')
+
+    return scale, var.initialization
+
+
+@workload('array-list-nd')
+def array_list_nd(scale):
+    side = cube(scale)
+    value = np.arange(side**3).reshape(side, side, side).tolist()
+    var = csnake.Variable('x', 'int', value=value)
+
+    return side**3, var.initialization
+
+
+@workload('array-list-float-2d')
+def array_list_float_2d(scale):
+    side = square(scale)
+    value = np.random.RandomState(0).rand(side, side).tolist()
+    var = csnake.Variable('x', 'double', value=value)
+
+    return side**2, var.initialization
+
+
+@workload('array-numpy-1d')
+def array_numpy_1d(scale):
+    var = csnake.Variable('x', 'int', value=np.arange(scale))
+
+    return scale, var.initialization
+
+
+@workload('array-numpy-1d-formatted')
+def array_numpy_1d_formatted(scale):
+    var = csnake.Variable(
+        'x',
+        'uint32_t',
+        value=np.arange(scale, dtype=np.uint32),
+        value_opts='0x{0:08X}')
+
+    return scale, var.initialization
+
+
+@workload('array-numpy-nd')
+def array_numpy_nd(scale):
+    side = cube(scale)
+    value = np.arange(side**3).reshape(side, side, side)
+    var = csnake.Variable('x', 'int', value=value)
+
+    return side**3, var.initialization
+
+
+@workload('array-numpy-float-2d')
+def array_numpy_float_2d(scale):
+    side = square(scale)
+    value = np.random.RandomState(0).rand(side, side)
+    var = csnake.Variable('x', 'double', value=value)
+
+    return side**2, var.initialization
+
+
+@workload('array-numpy-float32-2d')
+def array_numpy_float32_2d(scale):
+    side = square(scale)
+    value = np.random.RandomState(0).rand(side, side).astype(np.float32)
+    var = csnake.Variable('x', 'float', value=value)
+
+    return side**2, var.initialization
+
+
+@workload('struct-of-arrays')
+def struct_of_arrays(scale):
+    count = max(scale // 10, 1)
+    value = [{
+        'a': [i, i + 1, i + 2, i + 3],
+        'b': i * 0.5,
+        'c': {
+            'x': i,
+            'y': [i, i]
+        }
+    } for i in range(count)]
+    var = csnake.Variable('x', 'Struct_t', value=value)
+
+    return count * 10, var.initialization
+
+
+@workload('array-of-records')
+def array_of_records(scale):
+    count = max(scale // 6, 1)
+    value = np.zeros(
+        count, dtype=[('a', np.uint32), ('b', np.float64), ('c', np.int16, 4)])
+    value['a'] = np.arange(count)
+    value['b'] = np.random.RandomState(0).rand(count)
+    value['c'] = np.arange(count * 4).reshape(count, 4)
+    var = csnake.Variable('x', 'Struct_t', value=value)
+
+    return count * 6, var.initialization
+
+
+@workload('bitset')
+def bitset(scale):
+    bits = np.random.RandomState(0).rand(scale) > 0.5
+
+    def run():
+        writer = csnake.CodeWriter()
+        writer.add_bitset(csnake.Bitset('x', bits))
+
+        return writer.text
+
+    return scale, run
+
+
+@workload('add-line')
+def add_line(scale):
+    def run():
+        writer = csnake.CodeWriter()
+        writer.tab_in()
+
+        for i in range(scale):
+            writer.add_line('int x = 0;', comment='comment')
+
+        return writer.text
+
+    return scale, run
+
+
+@workload('add-struct')
+def add_struct(scale):
+    struct = csnake.Struct('Struct_t', typedef=True)
+
+    for i in range(scale):
+        struct.add_variable(
+            csnake.Variable('member{0}'.format(i), 'uint32_t', array=4))
+
+    def run():
+        writer = csnake.CodeWriter()
+        writer.add_struct(struct)
+
+        return writer.text
+
+    return scale, run
+
+
+@workload('add-enum')
+def add_enum(scale):
+    enum = csnake.Enum('Enum_t', prefix='ENUM_', typedef=True)
+
+    for i in range(scale):
+        enum.add_value('VALUE{0}'.format(i), value=i, comment='comment')
+
+    def run():
+        writer = csnake.CodeWriter()
+        writer.add_enum(enum)
+
+        return writer.text
+
+    return scale, run
+
+
+@workload('add-enum-lookup')
+def add_enum_lookup(scale):
+    count = max(scale // 10, 1)
+    enum = csnake.Enum('Enum_t', prefix='ENUM_', typedef=True)
+    enum.add_values('VALUE{0}'.format(i) for i in range(count))
+
+    def run():
+        writer = csnake.CodeWriter()
+        writer.add_enum_lookup(enum)
+
+        return writer.text
+
+    return count, run
+
+
+@workload('add-constant-pool')
+def add_constant_pool(scale):
+    count = max(scale // 10, 1)
+    strings = ['string{0}'.format(i % 1000) for i in range(count * 10)]
+    pool = csnake.ConstantPool('pool')
+    pool.add_variable(
+        csnake.Variable(
+            'x',
+            'char *const',
+            qualifiers=['static', 'const'],
+            value=np.array(strings).reshape(count, 10)))
+
+    def run():
+        writer = csnake.CodeWriter()
+        writer.add_constant_pool(pool)
+
+        return writer.text
+
+    return count * 10, run
+
+
+@workload('write-to-file')
+def write_to_file(scale):
+    writer = csnake.CodeWriter()
+
+    for i in range(scale):
+        writer.add_line('int x = 0;', comment='comment')
+    text = writer.text
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'output.c')
+
+    def run():
+        writer.write_to_file(path, force=True)
+
+        return text
+
+    return scale, run
+
+
+@workload('write-files')
+def write_files(scale):
+    count = 16
+    writers = []
+
+    for i in range(count):
+        writer = csnake.CodeWriter()
+        writer.add_variable_initialization(
+            csnake.Variable('x', 'int', value=np.arange(scale // count)))
+        writers.append(writer)
+    directory = tempfile.mkdtemp()
+    files = [(os.path.join(directory, 'output{0}.c'.format(i)), writer)
+             for i, writer in enumerate(writers)]
+
+    def run():
+        csnake.write_files(files, force=True)
+
+        return ''.join(writer.text for writer in writers)
+
+    return count * (scale // count), run
+
+
+# object name -> function creating one from an int
+OBJECTS = {
+    'EnumValue': lambda i: csnake.EnumValue('VALUE', i),
+    'Variable': lambda i: csnake.Variable('x', 'int', value=i),
+    'Struct': lambda i: csnake.Struct('Struct_t'),
+    'FuncPtr': lambda i: csnake.FuncPtr('void', ['int']),
+    'TextModifier': lambda i: csnake.TextModifier('x'),
+}
+
+
+def measure_objects(count=10000):
+    """Return the memory taken by each kind of object, in bytes."""
+    results = {}
+
+    for name, create in OBJECTS.items():
+        tracemalloc.start()
+        created = [create(i) for i in range(count)]
+        size = tracemalloc.get_traced_memory()[0] - sys.getsizeof(created)
+        tracemalloc.stop()
+        results[name] = size / count
+
+    return results
+
+
+def measure(name, scale, repeat):
+    """Run a workload and return its results."""
+    elements, run = WORKLOADS[name](scale)
+
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = run()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    megabytes = len(output) / 1e6
+
+    return {
+        'elements': elements,
+        'output_mb': megabytes,
+        'seconds': best,
+        'elements_per_second': elements / best if best else None,
+        'mb_per_second': megabytes / best if best else None,
+        'peak_memory_mb': peak / 1e6,
+    }
+
+
+IMPORT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import csnake
+print(time.perf_counter() - start, 'numpy' in sys.modules)
+'''
+
+
+def measure_import(repeat):
+    """Return the best time importing csnake takes in a new interpreter, and
+    whether it imported NumPy."""
+    times = []
+
+    for _ in range(max(repeat, 5)):
+        output = subprocess.run(
+            [sys.executable, '-c', IMPORT_SCRIPT],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True).stdout.split()
+        times.append(float(output[0]))
+
+    return min(times), output[1] == 'True'
+
+
+def main(argv=None):
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--scale',
+        type=int,
+        default=100000,
+        help='number of elements per workload (default: %(default)s)')
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='timed runs per workload, the best counts (default: '
+        '%(default)s)')
+    parser.add_argument(
+        '--only',
+        nargs='+',
+        choices=sorted(WORKLOADS),
+        help='workloads to run')
+    parser.add_argument('--output', help='save the results to a JSON file')
+    parser.add_argument(
+        '--compare', help='JSON results of another run to compare against')
+    parser.add_argument(
+        '--import-budget',
+        type=float,
+        help='fail if importing csnake takes longer (in milliseconds)')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+
+    if args.compare:
+        with open(args.compare) as the_file:
+            baseline = json.load(the_file)
+
+    import_seconds, imports_numpy = measure_import(args.repeat)
+    print('{0:<26} {1:>14.1f} ms{2}'.format(
+        'import', import_seconds * 1000,
+        ' (imports NumPy)' if imports_numpy else ''))
+
+    objects = measure_objects()
+    baseline_objects = baseline.get('bytes_per_object', {})
+
+    for name, size in objects.items():
+        line = '{0:<26} {1:>14.1f} B/object'.format(name, size)
+
+        if baseline_objects.get(name):
+            line += ' {0:>7.2f}x'.format(baseline_objects[name] / size)
+        print(line)
+    results = {}
+
+    for name in args.only or WORKLOADS:
+        result = measure(name, args.scale, args.repeat)
+        results[name] = result
+
+        line = ('{name:<26} {eps:>14,.0f} el/s {mbps:>9.2f} MB/s '
+                '{peak:>9.2f} MB peak'.format(
+                    name=name,
+                    eps=result['elements_per_second'] or 0,
+                    mbps=result['mb_per_second'] or 0,
+                    peak=result['peak_memory_mb']))
+
+        baseline_result = baseline.get('results', {}).get(name)
+
+        if baseline_result and baseline_result['seconds']:
+            line += ' {0:>7.2f}x'.format(
+                baseline_result['seconds'] / result['seconds'])
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as the_file:
+            json.dump({
+                'version': csnake.CodeWriter.VERSION,
+                'python': sys.version,
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'scale': args.scale,
+                'import_seconds': import_seconds,
+                'bytes_per_object': objects,
+                'results': results,
+            }, the_file, indent=2)
+
+    if args.import_budget is not None and (
+            imports_numpy or import_seconds * 1000 > args.import_budget):
+        sys.exit('importing csnake exceeds the budget of {0} ms'.format(
+            args.import_budget))
+
+
+if __name__ == '__main__':
+    main()
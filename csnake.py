@@ -1,8 +1,48 @@
 # -*- coding: utf-8 -*-
-import numpy as np
-from abc import ABCMeta, abstractmethod
-from typing import Iterable
+import mmap
+import os
+import re
+import sys
+from abc import ABCMeta, abstractmethod, get_cache_token
+from array import array as pyarray
+from collections import namedtuple
+from collections import deque
+from collections.abc import Iterable
+from itertools import repeat
+from queue import Queue
+from threading import Semaphore, Thread
+from string import Formatter
 from datetime import date
+from hashlib import sha256
+from time import perf_counter
+
+# NumPy is only imported when it is needed (to render values which aren't
+# NumPy objects already), which keeps importing this module fast.
+
+
+class _NumPy:
+    """Stand-in for the numpy module, which imports it on first use."""
+
+    def __getattr__(self, name):
+        global np
+        import numpy
+
+        np = numpy
+
+        return getattr(numpy, name)
+
+
+np = _NumPy()
+
+
+def _is_numpy(value, type_name='ndarray'):
+    """Check if value is an instance of a NumPy type, without importing
+    NumPy: nothing is, unless it has been imported already."""
+    numpy = sys.modules.get('numpy')
+
+    return numpy is not None and isinstance(value,
+                                            getattr(numpy, type_name, ()))
+
 
 # public helper functions
 
@@ -11,9 +51,12 @@ def shape(array):
     """Return dimensions (shape) of a multidimensional list."""
     # strings should return nothing
 
-    if isinstance(array, np.ndarray):
+    if isinstance(array, memoryview) or _is_numpy(array):
         return array.shape
 
+    if isinstance(array, Sparse) or _is_sparse(array):
+        return list(getattr(array, 'shape', None) or [])
+
     if isinstance(array, str):
         return ''
     curr = array
@@ -29,22 +72,157 @@ def shape(array):
             return shp
 
 
+ArrayInfo = namedtuple('ArrayInfo', ['shape', 'kind'])
+ArrayInfo.__doc__ = """Shape and element kind of a value (see array_info).
+
+kind is 'int', 'float', 'bool', 'string', 'modifier', 'struct' or 'other'
+when all the elements are of that kind ('float' also covers a mix of ints and
+floats), 'mixed' otherwise, and None if there are no elements.
+"""
+
+
+def array_info(value):
+    """Return the ArrayInfo of a (multidimensional) value.
+
+    Unlike shape(), the whole value is walked (once), and it must be
+    rectangular: a ValueError naming the first ragged element is raised
+    otherwise. Strings and dicts are elements, not arrays.
+    """
+
+    if _is_numpy(value):
+        if value.dtype.names is not None:
+            return ArrayInfo(value.shape, _STRUCT)
+
+        return ArrayInfo(value.shape, _DTYPE_KINDS.get(value.dtype.kind,
+                                                       _OTHER))
+
+    if isinstance(value, (memoryview, pyarray)):
+        return array_info(_as_ndarray(value))
+
+    kinds = _value_kinds()
+    dimensions = []
+    level = [value]
+
+    while level:
+        level_kinds = {kinds.get(type(item)) or _classify_value(item)
+                       for item in level}
+
+        if level_kinds != {_ARRAY}:
+            if _ARRAY in level_kinds:
+                raise ValueError(_ragged_message(value, dimensions))
+
+            if level_kinds == {_INT, _FLOAT}:
+                return ArrayInfo(tuple(dimensions), _FLOAT)
+
+            if len(level_kinds) > 1:
+                return ArrayInfo(tuple(dimensions), 'mixed')
+
+            return ArrayInfo(tuple(dimensions), level_kinds.pop())
+
+        if all(_is_numpy(item) for item in level):
+            if len({item.shape for item in level}) > 1:
+                raise ValueError(_ragged_message(value, dimensions))
+            dtype = np.result_type(*level)
+
+            return ArrayInfo(
+                tuple(dimensions) + level[0].shape,
+                _DTYPE_KINDS.get(dtype.kind, _OTHER))
+
+        lengths = {len(item) for item in level}
+
+        if len(lengths) > 1:
+            raise ValueError(_ragged_message(value, dimensions))
+        dimensions.append(lengths.pop())
+        level = [element for item in level for element in item]
+
+    return ArrayInfo(tuple(dimensions), None)
+
+
+def _ragged_message(value, dimensions):
+    """Describe the first element of value that breaks its rectangular shape
+    (known up to the given dimensions)."""
+
+    kinds = _value_kinds()
+
+    def is_array(item):
+        return (kinds.get(type(item)) or _classify_value(item)) == _ARRAY
+
+    def search(item, path):
+        depth = len(path)
+        expected = (dimensions[depth] if depth < len(dimensions) else
+                    len(first[depth]) if is_array(first[depth]) else None)
+
+        if is_array(item) != (expected is not None):
+            return path, 'an array' if is_array(item) else 'not an array'
+
+        if expected is None:
+            return None
+
+        if len(item) != expected:
+            return path, 'of length {0}, not {1}'.format(len(item), expected)
+
+        for i, element in enumerate(item):
+            found = search(element, path + [i])
+
+            if found:
+                return found
+
+        return None
+
+    # the first element at every depth sets the expectations
+    first = [value]
+
+    while is_array(first[-1]) and len(first[-1]):
+        first.append(first[-1][0])
+
+    found = search(value, [])
+    path, problem = found if found else ([], 'ragged')
+
+    return "ragged array: value{0} is {1}".format(
+        ''.join('[{0}]'.format(i) for i in path), problem)
+
+
 #types
+def _numpy_subclass(subclass, type_name):
+    """Check if subclass is a subclass of a NumPy type, if NumPy is loaded.
+
+    NumPy's types can't exist before NumPy is imported, so checking at that
+    point registers them exactly when they are first used.
+    """
+    numpy = sys.modules.get('numpy')
+    numpy_type = getattr(numpy, type_name, None)
+
+    if numpy_type is not None and issubclass(subclass, numpy_type):
+        return True
+
+    return NotImplemented
+
+
 class AnyInt(metaclass=ABCMeta):
     """Abstract class for any integer type: Python's int or numpy.integer."""
 
+    @classmethod
+    def __subclasshook__(cls, subclass):
+        if cls is AnyInt:
+            return _numpy_subclass(subclass, 'integer')
+        return NotImplemented
+
 
 AnyInt.register(int)
-AnyInt.register(np.integer)
 
 
 class AnyFloat(metaclass=ABCMeta):
     """Abstract class for any floating type: Python's float or numpy.floating.
     """
 
+    @classmethod
+    def __subclasshook__(cls, subclass):
+        if cls is AnyFloat:
+            return _numpy_subclass(subclass, 'floating')
+        return NotImplemented
+
 
 AnyFloat.register(float)
-AnyFloat.register(np.floating)
 
 
 class AnyArrayValue(metaclass=ABCMeta):
@@ -67,365 +245,1525 @@ class AnyStructValue(metaclass=ABCMeta):
 
 AnyStructValue.register(dict)
 
-# classes defining C constructs
+# rendering engines
 
 
-class EnumValue:
-    """Singular value of an C-style enumeration."""
+def _as_ndarray(value):
+    """Return a buffer-backed value (array.array or memoryview) as an ndarray.
 
-    def __init__(self, name, value=None, comment=None):
-        self.name = name
-        self.value = value
-        self.comment = comment
+    The data isn't copied. Floating point buffers are widened to double, so
+    that they render the same as the Python floats they would yield when
+    iterated.
+    """
+    ndarray = np.asarray(value)
 
+    if ndarray.dtype.kind == 'f' and ndarray.dtype != np.float64:
+        ndarray = ndarray.astype(np.float64)
 
-class Enum:
-    """C-style enumeration class."""
+    return ndarray
 
-    def __init__(self, name, prefix="", typedef=False):
 
-        self.typedef = typedef
-        # enum values
-        self.values = []
-        self.name = name
+# a format spec, as in the format specification mini-language
+_FORMAT_SPEC = re.compile(
+    r'(?:(?P<fill>.)?(?P<align>[<>=^]))?(?P<sign>[-+ ])?(?P<z>z)?'
+    r'(?P<alternate>#)?(?P<zero>0)?(?P<width>\d+)?(?P<grouping>[,_])?'
+    r'(?:\.(?P<precision>\d+))?(?P<type>[bcdeEfFgGnosxX%])?\Z', re.DOTALL)
 
-        self.prefix = prefix
+_RADICES = {
+    None: (10, b'0123456789', b''),
+    'd': (10, b'0123456789', b''),
+    'x': (16, b'0123456789abcdef', b'0x'),
+    'X': (16, b'0123456789ABCDEF', b'0X'),
+    'o': (8, b'01234567', b'0o'),
+    'b': (2, b'01', b'0b'),
+}
 
-    def add_value(self, name, value=None, comment=None):
-        """Assures that the user adds the values in the correct order."""
-        self.values.append(EnumValue(name, value=value, comment=comment))
 
+class _Formatter:
+    """value_opts compiled for formatting whole ndarrays.
 
-class FuncPtr:
-    """Function pointer description."""
+    A format string made of literal text around a single replacement field
+    is split up, so that each value is formatted with format(value, spec).
+    Integers with a plain (decimal, hex, octal or binary) spec are formatted
+    without any Python objects: their digits are computed and laid out as
+    bytes with NumPy. Other format strings are applied value by value.
 
-    def __init__(self, return_type, args=None, comment=None):
-        self.return_type = return_type
-        self.args = args
+    Besides the standard spec, 'r' formats numbers like str() (the shortest
+    representation that round-trips, in the precision of the value's type).
+    The results are the same as those of formatstring.format(value).
+    """
 
-    def get_declaration(self, name):
-        """Generate the whole declaration."""
-        jointargs = self.args
+    def __init__(self, formatstring):
+        self.formatstring = formatstring
+        self.prefix = self.suffix = ''
+        self.spec = ''
+        self.fields = None  # parsed spec, if the values can be vectorized
 
-        if isinstance(self.args, (AnyArrayValue)):
-            jointargs = ', '.join(jointargs)
+        if formatstring is None:
+            self.simple = True
+            self.fields = _FORMAT_SPEC.match('').groupdict()
 
-        retval = '{rt} (*{name})({args})'.format(
-            rt=self.return_type,
-            name=name,
-            args=jointargs if self.args else '')
+            return
 
-        return retval
+        try:
+            parsed = list(Formatter().parse(formatstring))
+        except ValueError:
+            parsed = []
+        replacements = [item for item in parsed if item[1] is not None]
+        self.simple = (len(replacements) == 1 and replacements[0] is parsed[0]
+                       and replacements[0][1] in ('', '0')
+                       and replacements[0][3] is None
+                       and '{' not in replacements[0][2])
+
+        if not self.simple:
+            return
 
+        self.prefix = parsed[0][0]
+        self.spec = parsed[0][2]
+        self.suffix = ''.join(item[0] for item in parsed[1:])
 
-class Variable:
-    """C-style variable."""
+        match = _FORMAT_SPEC.match(self.spec)
 
-    def __init__(self,
-                 name,
-                 primitive,
-                 qualifiers=None,
-                 array=None,
-                 comment=None,
-                 value=None,
-                 value_opts=None):
-        self.name = name
-        self.primitive = primitive
-        self.comment = comment
-        self.array = array
-        self.qualifiers = qualifiers
-        self.value = value
-        self.value_opts = value_opts
+        if match:
+            self.fields = match.groupdict()
 
-    def __array_dimensions(self):
-        if isinstance(self.array, AnyArrayValue):
-            array = "".join("[{0}]".format(dim) for dim in self.array)
-        elif self.array is not None:
-            array = "[{dim}]".format(dim=str(self.array))
-        elif self.array is None and isinstance(self.value, str):
-            array = '[]'
-        elif self.array is None and shape(self.value):
-            array = "".join("[{0}]".format(dim) for dim in shape(self.value))
+    def format(self, value):
+        """Format a single value."""
+
+        if not self.simple:
+            return self.formatstring.format(value)
+
+        if self.spec == 'r' or self.formatstring is None:
+            text = str(value)
         else:
-            array = ""
+            text = format(value, self.spec)
 
-        return array
+        return self.prefix + text + self.suffix
 
-    def declaration(self, extern=False):
-        """Return a declaration string."""
+    def tokens(self, block):
+        """Return an iterable of the formatted values of a 1D ndarray.
 
-        if not isinstance(self.qualifiers, str) and isinstance(
-                self.qualifiers, Iterable):
-            qual = " ".join(self.qualifiers) + " "
-        elif self.qualifiers is not None:
-            qual = str(self.qualifiers) + " "
+        Floats narrower or wider than double are formatted as NumPy scalars
+        (their shortest representation differs from Python's); all other
+        values are converted to Python scalars in bulk first.
+        """
+
+        if block.dtype.kind == 'f' and block.dtype != np.float64:
+            values = block
         else:
-            qual = ""
+            values = block.tolist()
 
-        array = self.__array_dimensions()
+        if not self.simple:
+            return map(self.formatstring.format, values)
 
-        if isinstance(self.primitive, FuncPtr):
-            decl = self.primitive.get_declaration(self.name)
+        if self.spec == 'r' or self.formatstring is None:
+            tokens = map(str, values)
+        else:
+            tokens = map(format, values, repeat(self.spec))
 
-            return '{ext}{qual}{decl}{array}'.format(
-                ext='extern ' if extern else '',
-                qual=qual,
-                decl=decl,
-                array=array)
+        if self.prefix or self.suffix:
+            return (self.prefix + token + self.suffix for token in tokens)
 
-        return '{ext}{qual}{prim} {name}{array}'.format(
-            ext='extern ' if extern else '',
-            qual=qual,
-            prim=self.primitive,
-            name=self.name,
-            array=array)
+        return tokens
 
-    def initialization(self, indent='    '):
-        """Return an initialization string."""
+    def join(self, block, separator=', '):
+        """Return the formatted values of a 1D ndarray, joined by separator.
+        """
 
-        def generate_single_var(var_, formatstring=None):
-            """Generate single variable."""
+        if not len(block):
+            return ''
 
-            if isinstance(var_, str):
-                return "\"{val}\"".format(val=var_)
-            elif isinstance(var_, Modifier):
-                return var_.name
-            elif isinstance(var_, bool):
-                return 'true' if var_ else 'false'
-            elif isinstance(var_, (AnyInt, AnyFloat)):
-                if formatstring is None:
-                    return str(var_)
+        if not self._vectorizes(block):
+            if (not self.simple or self.spec == 'r'
+                    or self.formatstring is None):
+                return separator.join(self.tokens(block))
 
-                return formatstring.format(var_)
+            values = (block if block.dtype.kind == 'f'
+                      and block.dtype != np.float64 else block.tolist())
 
-        def generate_array(array, indent='    ', formatstring=None):
-            """Print (multi)dimensional arrays."""
+            return (self.prefix + (self.suffix + separator + self.prefix).join(
+                map(format, values, repeat(self.spec))) + self.suffix)
 
-            class OpenBrace:
-                """Helper class to identify open braces while printing."""
+        step = 1 << 16
 
-            class ClosedBrace:
-                """Helper class to identify closed braces while printing."""
+        return separator.join(
+            self._join_ints(block[start:start + step].reshape(1, -1),
+                            separator)[0]
+            for start in range(0, len(block), step))
 
-            class Designator:
-                """Helper class to identify struct designators."""
+    def join_rows(self, matrix, separator=', '):
+        """Yield the rows of a 2D ndarray, formatted and joined by separator.
+        """
 
-                def __init__(self, name):
-                    self.name = name
+        if not self._vectorizes(matrix) or not matrix.shape[1]:
+            for row in matrix:
+                yield self.join(row, separator)
 
-            depth = 0
-            stack = []
-            stack.append(array)
-            output = ''
-            leading_comma = False
+            return
 
-            while stack:
-                top = stack.pop()
-                # non-printed tokens
+        step = max((1 << 16) // matrix.shape[1], 1)
+
+        for start in range(0, len(matrix), step):
+            yield from self._join_ints(matrix[start:start + step], separator)
+
+    def _vectorizes(self, block):
+        """Check if a block can be formatted with NumPy."""
+        fields = self.fields
+
+        return (fields is not None and block.dtype.kind in 'iu'
+                and block.dtype.itemsize <= 8 and fields['align'] is None
+                and fields['z'] is None and fields['grouping'] is None
+                and fields['precision'] is None
+                and fields['type'] in _RADICES)
+
+    def _join_ints(self, matrix, separator):
+        """Return the rows of a 2D integer ndarray, formatted and joined by
+        separator, laid out as bytes with NumPy."""
+        fields = self.fields
+        base, digits, radix = _RADICES[fields['type']]
+        radix = radix if fields['alternate'] else b''
+        sign = (fields['sign'] or '-').encode('ascii')
+        width = int(fields['width'] or 0)
+        prefix = self.prefix.encode('utf-8')
+        tail = (self.suffix + separator).encode('utf-8')
+        block = matrix.reshape(-1)
+        count = len(block)
+        rows = np.arange(count)
+
+        if block.dtype.kind == 'u':
+            negative = np.zeros(count, dtype=bool)
+            magnitude = block.astype(np.uint64)
+        else:
+            negative = block < 0
+            magnitude = block.astype(np.int64).astype(np.uint64)
+            magnitude[negative] = ~magnitude[negative] + np.uint64(1)
+
+        # digits, right-aligned, with leading zeros
+        columns = len(np.base_repr(int(magnitude.max()), base))
+        digit_values = np.empty((count, columns), dtype=np.uint8)
+
+        for column in range(columns - 1, -1, -1):
+            digit_values[:, column] = magnitude % np.uint64(base)
+            magnitude //= np.uint64(base)
+        nonzero = digit_values != 0
+        lengths = columns - np.where(
+            nonzero.any(axis=1), nonzero.argmax(axis=1), columns - 1)
+
+        # sign, radix prefix and padding
+        signs = negative | (sign != b'-')
+        core = signs + len(radix) + lengths
+        padding = np.maximum(width - core, 0)
+
+        if fields['zero']:
+            zeros, spaces = padding, 0
+        else:
+            zeros, spaces = 0, padding
+        body = lengths + zeros  # digits, including zero padding
+        token_lengths = len(prefix) + spaces + core + zeros
+        total = int(token_lengths.max())
+        body_width = int(body.max())
 
-                if isinstance(top, AnyArrayValue):
-                    stack.append(ClosedBrace())
-                    stack.extend(top[::-1])
-                    stack.append(OpenBrace())
+        chars = np.zeros((count, total + len(tail)), dtype=np.uint8)
 
-                    continue
+        if body_width > columns:
+            chars[:, total - body_width:total - columns] = ord('0')
+        chars[:, total - columns:total] = np.frombuffer(
+            digits, dtype=np.uint8)[digit_values]
+        chars[:, total:] = np.frombuffer(tail, dtype=np.uint8)
 
-                if isinstance(top, AnyStructValue):
-                    stack.append(ClosedBrace())
-                    dict_pairs = [[value, Designator(key)]
-                                  for key, value in top.items()][::-1]
-                    flatdict = [
-                        item for sublist in dict_pairs for item in sublist
-                    ]
-                    stack.extend(flatdict)
-                    stack.append(OpenBrace())
+        starts = total - token_lengths
 
-                    continue
-                # non-comma-delimited tokens
+        for offset, char in enumerate(prefix):
+            chars[rows, starts + offset] = char
+        position = starts + len(prefix)
 
-                if isinstance(top, ClosedBrace):
-                    depth -= 1 if depth > 0 else 0
-                    output += '}'
+        if fields['width'] and not fields['zero']:
+            column_indices = np.arange(total + len(tail))
+            chars[(column_indices >= position[:, None])
+                  & (column_indices < (position + spaces)[:, None])] = ord(' ')
+            position = position + spaces
 
-                    if stack:
-                        if isinstance(stack[-1], ClosedBrace):
-                            output += '\n' + (indent * (depth - 1))
-                        elif isinstance(stack[-1], Designator):
-                            output += ','
-                        else:
-                            output += ',\n' + (indent * depth)
-                        leading_comma = False
+        sign_chars = np.where(negative, ord('-'), sign[0]).astype(np.uint8)
+        chars[rows[signs], position[signs]] = sign_chars[signs]
+        position = position + signs
 
-                    continue
-                # check the need for leading comma
+        for offset, char in enumerate(radix):
+            chars[rows, position + offset] = char
 
-                if leading_comma:
-                    output += ', '
-                else:
-                    leading_comma = True
-                # (potentially) comma delimited tokens
+        valid = np.arange(total + len(tail)) >= starts[:, None]
 
-                if isinstance(top, OpenBrace):
-                    output += '{'
-                    depth += 1
+        if separator:
+            # no separator after the last value of a row
+            valid[matrix.shape[1] - 1::matrix.shape[1],
+                  total + len(tail) - len(separator.encode('utf-8')):] = False
+        data = chars[valid].tobytes()
+        ends = np.cumsum(valid.sum(axis=1).reshape(matrix.shape).sum(axis=1))
 
-                    if isinstance(stack[-1],
-                                  (OpenBrace, AnyArrayValue, AnyStructValue)):
-                        output += '\n' + (indent * depth)
-                    leading_comma = False
+        return [
+            data[start:end].decode('utf-8')
+            for start, end in zip([0] + ends[:-1].tolist(), ends.tolist())
+        ]
 
-                    continue
 
-                if isinstance(top, (AnyInt, AnyFloat, str, bool, Modifier)):
-                    output += generate_single_var(top, formatstring)
+_FORMATTERS = {}
 
-                    continue
 
-                if isinstance(top, Designator):
-                    output += '\n' + (indent * depth)
-                    output += '.' + top.name + ' = '
-                    leading_comma = False
+def _compile_format(formatstring):
+    """Return the (cached) _Formatter of a format string."""
 
-                    continue
+    try:
+        return _FORMATTERS[formatstring]
+    except KeyError:
+        formatter = _FORMATTERS[formatstring] = _Formatter(formatstring)
 
-            return output
+        return formatter
 
-        # main part: generating initializer
 
-        if not isinstance(self.qualifiers, str) and isinstance(
-                self.qualifiers, Iterable):
-            qual = " ".join(self.qualifiers) + " "
-        elif self.qualifiers is not None:
-            qual = str(self.qualifiers) + " "
-        else:
-            qual = ""
+def _format_block(block, formatstring=None):
+    """Return an iterable of formatted numeric values from an ndarray."""
 
-        array = self.__array_dimensions()
+    return _compile_format(formatstring).tokens(block)
 
-        if isinstance(self.value, (AnyArrayValue, AnyStructValue)):
-            assignment = '\n' if len(shape(self.value)) > 1 else ''
-            assignment += generate_array(self.value, indent, self.value_opts)
-        else:
-            assignment = generate_single_var(self.value, self.value_opts)
 
-        assignment_string = ' = ' + assignment if assignment else ''
+def _iter_ndarray(array, indent='    ', formatstring=None, depth=0):
+    """Yield the initializer of a numeric ndarray in chunks.
 
-        if isinstance(self.primitive, FuncPtr):
-            decl = self.primitive.get_declaration(self.name)
+    The layout (braces, line breaks and indentation) is identical to the one
+    produced for nested lists, but whole rows are formatted at once.
+    """
+    if array.ndim == 1:
+        yield '{' + _compile_format(formatstring).join(array) + '}'
 
-            return '{qual}{decl}{array}{assignment_string};'.format(
-                qual=qual,
-                decl=decl,
-                array=array,
-                assignment_string=assignment_string)
+        return
 
-        return '{qual}{prim} {name}{array}{assignment_string};'.format(
-            qual=qual,
-            prim=self.primitive,
-            name=self.name,
-            array=array,
-            assignment_string=assignment_string)
+    if not len(array):
+        yield '{}'
 
+        return
 
-class Struct:
-    """C-style struct class."""
+    newline = '\n' + indent * (depth + 1)
+    yield '{' + newline
 
-    def __init__(self, name, typedef=False, comment=None):
-        self.name = name  # definition name of this struct e.g. Struct_t
-        self.variables = []
-        self.comment = comment
-        self.typedef = typedef
+    if array.ndim == 2:
+        rows = _compile_format(formatstring).join_rows(array)
 
-    def add_variable(self, variable):
-        """Add another variable to struct."""
+        for i, row in enumerate(rows):
+            yield ('{' if not i else '},' + newline + '{') + row
+        yield '}'
+    else:
+        for i, subarray in enumerate(array):
+            if i:
+                yield ',' + newline
+            yield from _iter_ndarray(subarray, indent, formatstring, depth + 1)
+    yield '\n' + indent * depth + '}'
 
-        if not isinstance(variable, Variable):
-            raise TypeError("variable must be 'Variable'")
-        self.variables.append(variable)
 
+# Rendering kinds of values. The kind of a value depends only on its type, so
+# it is classified once per type and looked up in a table afterwards.
+_ARRAY = 'array'
+_STRUCT = 'struct'
+_STRING = 'string'
+_MODIFIER = 'modifier'
+_BOOL = 'bool'
+_INT = 'int'
+_FLOAT = 'float'
+_OPENBRACE = 'open brace'
+_CLOSEDBRACE = 'closed brace'
+_DESIGNATOR = 'designator'
+_OTHER = 'other'
 
-class Modifier(metaclass=ABCMeta):
-    """Abstract base class for initialization modifiers.
+_SCALARS = frozenset((_STRING, _MODIFIER, _BOOL, _INT, _FLOAT))
 
-    Sometimes we want to initialize a value to another variable, but in some
-    more complicated manner: using the address-of operator, dereference
-    operator, subscripting, typecasting... This is an ABC for those
-    modifiers.
-    """
 
-    @property
-    @abstractmethod
-    def name(self):
-        """Return a name for initialization."""
-        pass
+class _OpenBrace:
+    """Helper class to identify open braces while printing."""
 
 
-# no modifier is also a modifier!
-Modifier.register(Variable)
+class _ClosedBrace:
+    """Helper class to identify closed braces while printing."""
 
 
-class AddressOf(Modifier):
-    """Address of (&) modifier for variable initialization."""
+class _Designator:
+    """Helper class to identify struct designators."""
 
-    def __init__(self, target):
-        if not isinstance(target, (Modifier, Function)):
-            raise TypeError("Modifiers can only be used with variables, "
-                            "functions and modifiers.")
-        self.target = target
+    def __init__(self, name):
+        self.name = name
 
-    @property
-    def name(self):
-        return '&' + self.target.name
 
+_OPEN_BRACE = _OpenBrace()
+_CLOSED_BRACE = _ClosedBrace()
 
-class Dereference(Modifier):
-    """Dereference (*) modifier for variable initialization."""
+_KIND_TABLE = {}
+_KIND_TABLE_TOKEN = None
 
-    def __init__(self, target):
-        if not isinstance(target, Modifier):
-            raise TypeError(
-                "Modifiers can only be used with variables and modifiers.")
-        self.target = target
 
-    @property
-    def name(self):
-        return '*' + self.target.name
+def _value_kinds():
+    """Return the (type -> rendering kind) table.
 
+    The table is emptied whenever a class gets registered with any ABC, as
+    that can change the outcome of the isinstance checks it caches.
+    """
+    global _KIND_TABLE_TOKEN
 
-class Typecast(Modifier):
-    """Typecast modifier for variable initialization."""
+    token = get_cache_token()
 
-    def __init__(self, target, cast):
-        if not isinstance(target, Modifier):
-            raise TypeError(
-                "Modifiers can only be used with variables and modifiers.")
-        self.target = target
-        self.cast = cast
+    if token != _KIND_TABLE_TOKEN:
+        _KIND_TABLE.clear()
+        _KIND_TABLE[_OpenBrace] = _OPENBRACE
+        _KIND_TABLE[_ClosedBrace] = _CLOSEDBRACE
+        _KIND_TABLE[_Designator] = _DESIGNATOR
+        _KIND_TABLE_TOKEN = token
 
-    @property
-    def name(self):
-        return '(' + self.cast + ')' + self.target.name
+    return _KIND_TABLE
 
 
-class Subscript(Modifier):
-    """Subscript ([]) modifier for variable initialization."""
+def _classify_value(value):
+    """Classify the type of value using the ABCs, and remember the result."""
 
-    def __init__(self, target, subscript):
-        if not isinstance(target, Modifier):
-            raise TypeError(
-                "Modifiers can only be used with variables and modifiers.")
+    if isinstance(value, AnyArrayValue):
+        kind = _ARRAY
+    elif isinstance(value, AnyStructValue):
+        kind = _STRUCT
+    elif isinstance(value, str):
+        kind = _STRING
+    elif isinstance(value, Modifier):
+        kind = _MODIFIER
+    elif isinstance(value, bool):
+        kind = _BOOL
+    elif isinstance(value, AnyInt):
+        kind = _INT
+    elif isinstance(value, AnyFloat):
+        kind = _FLOAT
+    else:
+        kind = _OTHER
 
-        if not isinstance(subscript, (AnyInt, Modifier, AnyArrayValue)):
-            raise TypeError(
-                "Subscript must be an AnyInt, Modifier (or Variable), list or"
-                " tuple.")
+    _value_kinds()[type(value)] = kind
 
-        if not subscript:
-            raise TypeError("Subscript must be non-empty.")
+    return kind
 
-        if isinstance(subscript, (AnyInt, Modifier)):
-            self.subscript = [subscript]
-        else:
+
+def _bits(array):
+    """Return a view of a numeric ndarray whose elements compare bitwise.
+
+    This keeps -0.0 apart from 0.0 and makes NaNs equal to themselves.
+    """
+
+    if array.dtype.kind == 'f' and array.dtype.itemsize in (2, 4, 8):
+        return array.view('u{0}'.format(array.dtype.itemsize))
+
+    return array
+
+
+def _runs(bits):
+    """Return the starts and ends of the runs of equal elements of an array
+    (compared along the first axis)."""
+
+    count = len(bits)
+
+    if not count:
+        return [], []
+
+    if bits.ndim == 1:
+        change = bits[1:] != bits[:-1]
+    elif bits.size:
+        change = (bits[1:] != bits[:-1]).reshape(count - 1, -1).any(axis=1)
+    else:
+        change = np.zeros(count - 1, dtype=bool)
+
+    bounds = np.flatnonzero(change) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [count]))
+
+    return starts.tolist(), ends.tolist()
+
+
+def _iter_ndarray_compact(array,
+                          indent='    ',
+                          formatstring=None,
+                          gnu=False,
+                          min_run=4,
+                          depth=0):
+    """Yield the initializer of a numeric ndarray in chunks, run-length
+    compressed.
+
+    Runs of equal elements (or subarrays) are found in a vectorized pass and
+    only their first element is rendered. Runs of at least min_run zeros are
+    left out, relying on the zero-initialization of the elements that aren't
+    initialized explicitly; with gnu, other such runs become range
+    designators. The layout is the same as that of _iter_ndarray.
+    """
+
+    if not array.size:
+        yield from _iter_ndarray(array, indent, formatstring, depth)
+
+        return
+
+    bits = _bits(array)
+    starts, ends = _runs(bits)
+    firsts = bits[starts]
+
+    if array.ndim == 1:
+        zeros = (firsts == 0).tolist()
+        values = list(_format_block(array[starts], formatstring))
+    else:
+        zeros = (~firsts.reshape(len(starts), -1).any(axis=1)).tolist()
+        values = [
+            ''.join(
+                _iter_ndarray_compact(array[start], indent, formatstring,
+                                      gnu, min_run, depth + 1))
+            for start in starts
+        ]
+
+    items = []
+    designate = False
+
+    for start, end, value, zero in zip(starts, ends, values, zeros):
+        if zero and (end == len(array) or end - start >= min_run):
+            designate = True
+        elif gnu and end - start >= min_run:
+            items.append('[{0} ... {1}] = {2}'.format(start, end - 1, value))
+            designate = True
+        else:
+            if designate:
+                items.append('[{0}] = {1}'.format(start, value))
+            else:
+                items.append(value)
+            items.extend([value] * (end - start - 1))
+            designate = False
+
+    if not items:
+        yield '{0}'
+    elif array.ndim == 1:
+        yield '{' + ', '.join(items) + '}'
+    else:
+        newline = '\n' + indent * (depth + 1)
+        yield '{' + newline
+        yield (',' + newline).join(items)
+        yield '\n' + indent * depth + '}'
+
+
+def _is_sparse(value):
+    """Check if value is a sparse array: a scipy.sparse-like matrix or a dict
+    with integer (or tuple) keys."""
+
+    if hasattr(value, 'tocoo'):
+        return True
+
+    return (isinstance(value, dict) and bool(value) and all(
+        isinstance(key, (AnyInt, tuple)) for key in value))
+
+
+def _iter_sparse(sparse, dimensions, indent='    ', formatstring=None):
+    """Yield the initializer of a Sparse value in chunks.
+
+    Only the given elements are rendered, as designated initializers sorted
+    by index; the work is proportional to their number.
+    """
+
+    indices, values = sparse.coo()
+
+    if not len(indices):
+        yield '{0}'
+
+        return
+
+    if indices.shape[1] != len(dimensions):
+        raise ValueError(
+            "sparse indices have {0} dimensions, the array has {1}".format(
+                indices.shape[1], len(dimensions)))
+
+    if all(isinstance(dim, AnyInt) for dim in dimensions):
+        outside = (indices < 0) | (indices >= np.asarray(dimensions))
+
+        if outside.any():
+            raise IndexError("sparse index {0} is out of bounds".format(
+                tuple(indices[outside.any(axis=1)][0].tolist())))
+
+    order = np.lexsort(indices.T[::-1])
+
+    if _is_numeric_ndarray(values):
+        tokens = _format_block(values[order], formatstring)
+    else:
+        tokens = (_format_single(values[i], formatstring) or ''
+                  for i in order.tolist())
+
+    designators = ('[' + ']['.join(map(str, index)) + ']'
+                   for index in indices[order].tolist())
+    items = (designator + ' = ' + token
+             for designator, token in zip(designators, tokens))
+
+    if indices.shape[1] == 1:
+        yield '{' + ', '.join(items) + '}'
+    else:
+        yield '{\n' + indent
+        yield (',\n' + indent).join(items)
+        yield '\n}'
+
+
+_DTYPE_KINDS = {
+    'b': _BOOL,
+    'i': _INT,
+    'u': _INT,
+    'f': _FLOAT,
+    'U': _STRING,
+    'S': _STRING,
+}
+
+
+def _is_numeric_ndarray(value):
+    """Check if value can be rendered by the ndarray engine."""
+
+    return (_is_numpy(value) and value.ndim > 0
+            and value.dtype.kind in 'iuf')
+
+
+def _is_record_ndarray(value):
+    """Check if value is a structured ndarray (an array of structs)."""
+
+    return (_is_numpy(value) and value.ndim > 0
+            and value.dtype.names is not None)
+
+
+def _format_single(var_, formatstring=None, kind=None):
+    """Format a single value (None if it can't be formatted)."""
+
+    if kind is None:
+        kind = _value_kinds().get(type(var_)) or _classify_value(var_)
+
+    if kind == _STRING:
+        return "\"{val}\"".format(val=var_)
+    elif kind == _MODIFIER:
+        return var_.name
+    elif kind == _BOOL:
+        return 'true' if var_ else 'false'
+    elif kind == _INT or kind == _FLOAT:
+        if formatstring is None:
+            return str(var_)
+
+        return _compile_format(formatstring).format(var_)
+
+
+def _iter_array(array, indent='    ', formatstring=None, depth=0):
+    """Yield (multi)dimensional arrays (and structs) in chunks."""
+
+    kinds = _value_kinds()
+    stack = []
+    stack.append(array)
+    leading_comma = False
+
+    while stack:
+        top = stack.pop()
+        kind = kinds.get(type(top)) or _classify_value(top)
+        # non-printed tokens
+
+        if kind == _ARRAY:
+            stack.append(_CLOSED_BRACE)
+            stack.extend(top[::-1])
+            stack.append(_OPEN_BRACE)
+
+            continue
+
+        if kind == _STRUCT:
+            stack.append(_CLOSED_BRACE)
+            dict_pairs = [[value, _Designator(key)]
+                          for key, value in top.items()][::-1]
+            flatdict = [
+                item for sublist in dict_pairs for item in sublist
+            ]
+            stack.extend(flatdict)
+            stack.append(_OPEN_BRACE)
+
+            continue
+        # non-comma-delimited tokens
+
+        if kind == _CLOSEDBRACE:
+            depth -= 1 if depth > 0 else 0
+            yield '}'
+
+            if stack:
+                next_kind = (kinds.get(type(stack[-1]))
+                             or _classify_value(stack[-1]))
+
+                if next_kind == _CLOSEDBRACE:
+                    yield '\n' + (indent * (depth - 1))
+                elif next_kind == _DESIGNATOR:
+                    yield ','
+                else:
+                    yield ',\n' + (indent * depth)
+                leading_comma = False
+
+            continue
+        # check the need for leading comma
+
+        if leading_comma:
+            yield ', '
+        else:
+            leading_comma = True
+        # (potentially) comma delimited tokens
+
+        if kind == _OPENBRACE:
+            yield '{'
+            depth += 1
+            next_kind = (kinds.get(type(stack[-1]))
+                         or _classify_value(stack[-1]))
+
+            if next_kind in (_OPENBRACE, _ARRAY, _STRUCT):
+                yield '\n' + (indent * depth)
+            leading_comma = False
+
+            continue
+
+        if kind in _SCALARS:
+            yield _format_single(top, formatstring, kind)
+
+            continue
+
+        if kind == _DESIGNATOR:
+            yield '\n' + (indent * depth)
+            yield '.' + top.name + ' = '
+            leading_comma = False
+
+            continue
+
+
+def _column_tokens(column, formatstring=None):
+    """Return the formatted values of a 1D ndarray (a field of records)."""
+
+    kind = column.dtype.kind
+
+    if kind in 'iu' and _compile_format(formatstring).fields is not None:
+        return _compile_format(formatstring).join_rows(column.reshape(-1, 1))
+
+    if kind in 'iuf':
+        return list(_compile_format(formatstring).tokens(column))
+
+    if kind == 'b':
+        return ['true' if item else 'false' for item in column.tolist()]
+
+    if kind == 'S':
+        return [
+            '"' + item.decode('latin-1') + '"' for item in column.tolist()
+        ]
+
+    return [
+        _format_single(item, formatstring) or '' for item in column.tolist()
+    ]
+
+
+def _record_rows(records, indent='    ', formatstring=None, depth=1):
+    """Return the initializers of a 1D structured ndarray, one per record.
+
+    Each record is rendered like a dict of its fields, with the struct's
+    braces at the given depth. The values are formatted field by field (one
+    column at a time) and only then spliced into records.
+    """
+
+    newline = '\n' + indent * depth
+    parts = []
+    closed = False  # the previous value ended with a brace
+
+    for i, name in enumerate(records.dtype.names):
+        column = records[name]
+        designator = newline + '.' + name + ' = '
+
+        if i:
+            designator = (',' if closed else ', ') + designator
+
+        if column.ndim > 1:
+            if column.dtype.names is not None:
+                values = [
+                    ''.join(_iter_records(item, indent, formatstring, depth))
+                    for item in column
+                ]
+            elif column.ndim == 2 and column.dtype.kind in 'iuf':
+                values = [
+                    '{' + row + '}' for row in _compile_format(
+                        formatstring).join_rows(column)
+                ]
+            elif column.dtype.kind in 'iuf':
+                values = [
+                    ''.join(_iter_ndarray(item, indent, formatstring, depth))
+                    for item in column
+                ]
+            else:
+                values = [
+                    ''.join(
+                        _iter_array(item.tolist(), indent, formatstring,
+                                    depth)) for item in column
+                ]
+            closed = True
+        elif column.dtype.names is not None:
+            values = _record_rows(column, indent, formatstring, depth + 1)
+            closed = True
+        else:
+            values = _column_tokens(column, formatstring)
+            closed = False
+        parts.append(map(str.__add__, repeat(designator), values))
+
+    end = '\n' + indent * (depth - 1) + '}' if closed else '}'
+
+    return list(map(''.join, zip(repeat('{'), *parts, repeat(end))))
+
+
+def _iter_records(array, indent='    ', formatstring=None, depth=0):
+    """Yield the initializer of a structured ndarray in chunks.
+
+    The layout is identical to the one produced for (nested) lists of dicts
+    holding the same fields.
+    """
+
+    if not len(array):
+        yield '{}'
+
+        return
+
+    newline = '\n' + indent * (depth + 1)
+    yield '{' + newline
+
+    if array.ndim == 1:
+        yield (',' + newline).join(
+            _record_rows(array, indent, formatstring, depth + 2))
+    else:
+        for i, subarray in enumerate(array):
+            if i:
+                yield ',' + newline
+            yield from _iter_records(subarray, indent, formatstring, depth + 1)
+    yield '\n' + indent * depth + '}'
+
+
+def _render_block(block, indent, formatstring, composite):
+    """Render a block of elements of the outermost dimension of an array.
+
+    Composite elements (arrays and structs) are rendered one level deep and
+    separated by line breaks, others are separated by commas. Runs in the
+    worker processes of _iter_array_parallel.
+    """
+
+    if composite:
+        render = _iter_ndarray if _is_numeric_ndarray(block) else _iter_array
+
+        return (',\n' + indent).join(''.join(render(element, indent,
+                                                    formatstring, 1))
+                                      for element in block)
+
+    if _is_numeric_ndarray(block):
+        return _compile_format(formatstring).join(block)
+
+    return ', '.join(
+        _format_single(element, formatstring) or '' for element in block)
+
+
+def _iter_array_parallel(array, indent, formatstring, processes):
+    """Yield (multi)dimensional arrays in chunks, rendered by many processes.
+
+    The outermost dimension is split into blocks which are rendered in a
+    process pool and spliced back in order; the output is identical to that
+    of the serial renderers. Structs and arrays mixing composite and single
+    elements are rendered serially.
+    """
+
+    if _is_numeric_ndarray(array):
+        composite = array.ndim > 1
+    elif isinstance(array, AnyArrayValue):
+        kinds = _value_kinds()
+        element_kinds = {
+            kinds.get(type(element)) or _classify_value(element)
+            for element in array
+        }
+        composite = bool(element_kinds & {_ARRAY, _STRUCT})
+
+        if composite and not element_kinds <= {_ARRAY, _STRUCT}:
+            composite = None
+    else:
+        composite = None
+
+    if composite is None or not len(array):
+        if _is_numeric_ndarray(array):
+            yield from _iter_ndarray(array, indent, formatstring)
+        else:
+            yield from _iter_array(array, indent, formatstring)
+
+        return
+
+    count = min(len(array), processes * 4)
+    bounds = [len(array) * i // count for i in range(count + 1)]
+    blocks = [array[start:end] for start, end in zip(bounds, bounds[1:])]
+    separator = ',\n' + indent if composite else ', '
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(processes) as executor:
+        yield '{\n' + indent if composite else '{'
+
+        for i, text in enumerate(
+                executor.map(_render_block, blocks, repeat(indent),
+                             repeat(formatstring), repeat(composite))):
+            if i:
+                yield separator
+            yield text
+
+        yield '\n}' if composite else '}'
+
+# classes defining C constructs
+
+
+class EnumValue:
+    """Singular value of an C-style enumeration."""
+
+    __slots__ = ('name', 'value', 'comment')
+
+    def __init__(self, name, value=None, comment=None):
+        self.name = name
+        self.value = value
+        self.comment = comment
+
+
+class Enum:
+    """C-style enumeration class."""
+
+    __slots__ = ('typedef', 'values', 'name', 'prefix')
+
+    def __init__(self, name, prefix="", typedef=False):
+
+        self.typedef = typedef
+        # enum values
+        self.values = []
+        self.name = name
+
+        self.prefix = prefix
+
+    def add_value(self, name, value=None, comment=None):
+        """Assures that the user adds the values in the correct order."""
+        self.values.append(EnumValue(name, value=value, comment=comment))
+
+    def add_values(self, names, values=None, comments=None):
+        """Add many values at once.
+
+        values and comments, if given, must be as long as names.
+        """
+
+        names = list(names)
+        values = [None] * len(names) if values is None else list(values)
+        comments = [None] * len(names) if comments is None else list(comments)
+
+        if not len(names) == len(values) == len(comments):
+            raise ValueError(
+                "names, values and comments must be of the same length")
+
+        self.values.extend(map(EnumValue, names, values, comments))
+
+
+class FuncPtr:
+    """Function pointer description."""
+
+    __slots__ = ('return_type', 'args')
+
+    def __init__(self, return_type, args=None, comment=None):
+        self.return_type = return_type
+        self.args = args
+
+    def get_declaration(self, name):
+        """Generate the whole declaration."""
+        jointargs = self.args
+
+        if isinstance(self.args, (AnyArrayValue)):
+            jointargs = ', '.join(jointargs)
+
+        retval = '{rt} (*{name})({args})'.format(
+            rt=self.return_type,
+            name=name,
+            args=jointargs if self.args else '')
+
+        return retval
+
+
+class Variable:
+    """C-style variable.
+
+    value_opts is a format string for the numbers in value. Besides the
+    standard format specs, 'r' formats them like str(): the shortest
+    representation that round-trips in their own precision, so that e.g.
+    '{0:r}f' renders a numpy.float32 0.1 as 0.1f.
+
+    Numeric NumPy (or buffer) values can be rendered compactly: with compact
+    set to 'c', runs of at least min_run zeros are left out, using index
+    designators ([i] = v) where needed; with 'gnu', runs of other values are
+    also written as GNU range designators ([a ... b] = v).
+
+    NumPy structured (record) arrays are arrays of structs: each record is
+    rendered like a dict of its fields, with designators named after them, so
+    the field names must match the variables of the struct. A single record
+    (numpy.void) is rendered as a struct.
+    """
+
+    __slots__ = ('name', 'primitive', 'comment', 'array', 'qualifiers',
+                 '_value', '_info_cache', 'value_opts', 'compact', 'min_run')
+
+    def __init__(self,
+                 name,
+                 primitive,
+                 qualifiers=None,
+                 array=None,
+                 comment=None,
+                 value=None,
+                 value_opts=None,
+                 compact=None,
+                 min_run=4):
+        self.name = name
+        self.primitive = primitive
+        self.comment = comment
+        self.array = array
+        self.qualifiers = qualifiers
+        self.value = value
+        self.value_opts = value_opts
+
+        if compact not in (None, 'c', 'gnu'):
+            raise ValueError("compact must be None, 'c' or 'gnu'")
+        self.compact = compact
+        self.min_run = min_run
+
+    @property
+    def value(self):
+        """Return the value the variable is initialized to."""
+
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._info_cache = None
+
+    def __info(self):
+        """Return the ArrayInfo of the value.
+
+        The value is checked to be rectangular and walked only once; the
+        result is kept until another value is assigned (mutating the value in
+        place isn't detected).
+        """
+
+        if self._info_cache is None:
+            if isinstance(self.value, Sparse) or _is_sparse(self.value):
+                self._info_cache = ArrayInfo(shape(self.value), None)
+            else:
+                self._info_cache = array_info(self.value)
+
+        return self._info_cache
+
+    def __shape(self):
+        """Return the shape of the value."""
+
+        return self.__info().shape
+
+    def __array_dimensions(self):
+        if isinstance(self.array, AnyArrayValue):
+            array = "".join("[{0}]".format(dim) for dim in self.array)
+        elif self.array is not None:
+            array = "[{dim}]".format(dim=str(self.array))
+        elif self.array is None and isinstance(self.value, str):
+            array = '[]'
+        elif self.array is None and self.__shape():
+            array = "".join("[{0}]".format(dim) for dim in self.__shape())
+        else:
+            array = ""
+
+        return array
+
+    def declaration(self, extern=False):
+        """Return a declaration string."""
+
+        if not isinstance(self.qualifiers, str) and isinstance(
+                self.qualifiers, Iterable):
+            qual = " ".join(self.qualifiers) + " "
+        elif self.qualifiers is not None:
+            qual = str(self.qualifiers) + " "
+        else:
+            qual = ""
+
+        array = self.__array_dimensions()
+
+        if isinstance(self.primitive, FuncPtr):
+            decl = self.primitive.get_declaration(self.name)
+
+            return '{ext}{qual}{decl}{array}'.format(
+                ext='extern ' if extern else '',
+                qual=qual,
+                decl=decl,
+                array=array)
+
+        return '{ext}{qual}{prim} {name}{array}'.format(
+            ext='extern ' if extern else '',
+            qual=qual,
+            prim=self.primitive,
+            name=self.name,
+            array=array)
+
+    def initialization(self, indent='    ', processes=None):
+        """Return an initialization string.
+
+        If processes is more than 1, large array values are rendered in a pool
+        of that many processes. The result is the same.
+        """
+
+        return ''.join(self._initialization_chunks(indent, processes))
+
+    def iter_initialization(self, indent='    ', processes=None):
+        """Yield the lines of the initialization string (without line feeds).
+
+        Lines are assembled from the rendered chunks as they are produced, so
+        the whole initializer is never held in memory at once.
+        """
+
+        pending = []
+
+        for chunk in self._initialization_chunks(indent, processes):
+            if '\n' not in chunk:
+                pending.append(chunk)
+
+                continue
+
+            lines = chunk.split('\n')
+            pending.append(lines[0])
+
+            yield ''.join(pending)
+            yield from lines[1:-1]
+            pending = [lines[-1]]
+
+        yield ''.join(pending)
+
+    def _initialization_chunks(self, indent, processes=None):
+        """Yield the initialization string in chunks.
+
+        Subclasses that render their value differently override this.
+        """
+
+        value = self.value
+
+        if not isinstance(value, Sparse) and _is_sparse(value):
+            value = Sparse(value)
+
+        if isinstance(value, Sparse):
+            dimensions = self.array if self.array is not None else value.shape
+
+            if dimensions is None:
+                raise ValueError(
+                    "sparse values need the array dimensions of the variable")
+
+            if not isinstance(dimensions, AnyArrayValue):
+                dimensions = [dimensions]
+
+            yield self.declaration()
+            yield ' = \n' if len(dimensions) > 1 else ' = '
+            yield from _iter_sparse(value, dimensions, indent,
+                                    self.value_opts)
+            yield ';'
+
+            return
+
+        if isinstance(value, (pyarray, memoryview)):
+            value = _as_ndarray(value)
+
+            if not _is_numeric_ndarray(value):
+                value = value.tolist()
+        elif isinstance(value, list) and not self.compact:
+            # lists of integers are rendered like ndarrays, which is faster
+            try:
+                kind = self.__info().kind
+            except ValueError:  # ragged, but the variable has its dimensions
+                kind = None
+
+            if kind == _INT:
+                array = np.array(value)
+
+                if array.dtype.kind in 'iu':
+                    value = array
+
+        yield self.declaration()
+
+        if _is_numpy(value, 'void') and value.dtype.names is not None:
+            yield ' = ' + _record_rows(
+                np.asarray(value).reshape(1), indent, self.value_opts)[0] + ';'
+
+            return
+
+        if _is_numeric_ndarray(value) or _is_record_ndarray(value):
+            yield ' = \n' if value.ndim > 1 else ' = '
+        elif isinstance(value, (AnyArrayValue, AnyStructValue)):
+            yield ' = \n' if len(shape(value)) > 1 else ' = '
+        else:
+            assignment = _format_single(self.value, self.value_opts)
+
+            if assignment:
+                yield ' = ' + assignment
+            yield ';'
+
+            return
+
+        if _is_record_ndarray(value):
+            yield from _iter_records(value, indent, self.value_opts)
+        elif self.compact and _is_numeric_ndarray(value):
+            yield from _iter_ndarray_compact(value, indent, self.value_opts,
+                                             self.compact == 'gnu',
+                                             self.min_run)
+        elif processes and processes > 1:
+            yield from _iter_array_parallel(value, indent, self.value_opts,
+                                            processes)
+        elif _is_numeric_ndarray(value):
+            yield from _iter_ndarray(value, indent, self.value_opts)
+        else:
+            yield from _iter_array(value, indent, self.value_opts)
+
+        yield ';'
+
+
+class Blob(Variable):
+    """C-style byte array holding binary data, rendered like xxd -i.
+
+    data can be bytes, bytearray, a memoryview (of any contiguous buffer) or
+    the path of a file; files are memory-mapped while rendering, so their
+    contents are never copied into Python objects. The bytes are written in
+    hex, bytes_per_line per line.
+    """
+
+    __slots__ = ('bytes_per_line', )
+
+    def __init__(self,
+                 name,
+                 data,
+                 primitive='uint8_t',
+                 qualifiers=None,
+                 array=None,
+                 comment=None,
+                 bytes_per_line=12):
+        super().__init__(
+            name,
+            primitive,
+            qualifiers=qualifiers,
+            array=array,
+            comment=comment,
+            value=data)
+
+        if bytes_per_line < 1:
+            raise ValueError("bytes_per_line must be positive")
+        self.bytes_per_line = bytes_per_line
+
+        if self.array is None:
+            if isinstance(data, (str, os.PathLike)):
+                self.array = os.path.getsize(data)
+            else:
+                self.array = memoryview(data).nbytes
+
+    def _initialization_chunks(self, indent, processes=None):
+        """Yield the initialization string in chunks."""
+
+        yield self.declaration()
+        yield ' = {'
+
+        if isinstance(self.value, (str, os.PathLike)):
+            with open(self.value, 'rb') as the_file:
+                if os.fstat(the_file.fileno()).st_size:
+                    with mmap.mmap(
+                            the_file.fileno(), 0,
+                            access=mmap.ACCESS_READ) as mapped:
+                        yield from self.__hex_rows(
+                            memoryview(mapped), indent)
+        else:
+            yield from self.__hex_rows(
+                memoryview(self.value).cast('B'), indent)
+
+        yield '};'
+
+    def __hex_rows(self, data, indent):
+        """Yield the hex rows of a byte memoryview."""
+
+        step = self.bytes_per_line
+        separator = '\n' + indent + '0x'
+
+        try:
+            for start in range(0, len(data), step):
+                yield separator + data[start:start + step].hex(' ').replace(
+                    ' ', ', 0x')
+                separator = ',\n' + indent + '0x'
+
+            if data:
+                yield '\n'
+        finally:
+            data.release()
+
+
+# word type of a Bitset -> its width in bits
+_WORD_BITS = {'uint8_t': 8, 'uint16_t': 16, 'uint32_t': 32, 'uint64_t': 64}
+
+
+class Bitset(Variable):
+    """C-style array of words holding the bits of a boolean array.
+
+    bits is a (multidimensional) array of truth values, typically a NumPy
+    bool_ array; it is flattened in C order and packed into words of
+    primitive, one of uint8_t, uint16_t, uint32_t and uint64_t: bit i is bit
+    i % W of word i / W, W being the width of the words. The words are written
+    in hex, and length is the number of bits.
+
+    CodeWriter.add_bitset adds the array with accessors for the bits, as
+    macros (<NAME>_TEST(i), <NAME>_SET(i) and <NAME>_CLEAR(i)) or inline
+    functions (<name>_test, <name>_set and <name>_clear); a const bitset only
+    gets the test accessor.
+    """
+
+    __slots__ = ('length', )
+
+    def __init__(self,
+                 name,
+                 bits,
+                 primitive='uint32_t',
+                 qualifiers=None,
+                 comment=None):
+        if primitive not in _WORD_BITS:
+            raise ValueError("primitive must be one of " +
+                             ', '.join(_WORD_BITS))
+        bits = np.asarray(bits).astype(bool, copy=False).ravel()
+
+        if not len(bits):
+            raise ValueError("a bitset needs at least one bit")
+        word_bytes = _WORD_BITS[primitive] // 8
+        packed = np.packbits(bits, bitorder='little')
+        padded = np.zeros(-(-len(packed) // word_bytes) * word_bytes,
+                          dtype=np.uint8)
+        padded[:len(packed)] = packed
+
+        super().__init__(
+            name,
+            primitive,
+            qualifiers=qualifiers,
+            comment=comment,
+            value=padded.view('<u{0}'.format(word_bytes)),
+            value_opts='0x{{0:0{0}X}}'.format(word_bytes * 2))
+        self.length = len(bits)
+
+    @property
+    def word_bits(self):
+        """Return the width of the words, in bits."""
+
+        return _WORD_BITS[self.primitive]
+
+    def _mutable(self):
+        """Return whether the bits can be set and cleared."""
+
+        return 'const' not in (self.qualifiers or [])
+
+    def macros(self):
+        """Return the (name, value) of the accessor macros."""
+
+        macro = self.name.upper()
+        word = '{0}[(i) / {1}]'.format(self.name, self.word_bits)
+        mask = '(({0})1 << ((i) % {1}))'.format(self.primitive,
+                                                 self.word_bits)
+        macros = [(macro + '_TEST(i)', '(({0} & {1}) != 0)'.format(word,
+                                                                  mask))]
+
+        if self._mutable():
+            macros.append((macro + '_SET(i)', '({0} |= {1})'.format(
+                word, mask)))
+            macros.append((macro + '_CLEAR(i)', '({0} &= ~{1})'.format(
+                word, mask)))
+
+        return macros
+
+    def accessors(self):
+        """Return the accessor Functions."""
+
+        word = '{0}[i / {1}]'.format(self.name, self.word_bits)
+        mask = '(({0})1 << (i % {1}))'.format(self.primitive, self.word_bits)
+        operations = [('test', 'int', 'return ({0} & {1}) != 0;')]
+
+        if self._mutable():
+            operations.append(('set', 'void', '{0} |= {1};'))
+            operations.append(('clear', 'void', '{0} &= ~{1};'))
+        functions = []
+
+        for operation, return_type, code in operations:
+            func = Function(self.name + '_' + operation, return_type,
+                            ['static', 'inline'])
+            func.add_argument(Variable('i', 'size_t'))
+            func.add_code(code.format(word, mask))
+            functions.append(func)
+
+        return functions
+
+
+class Sparse:
+    """Sparse array value, rendered as designated initializers.
+
+    entries can be a {index: value} dict, a COO pair (indices, values) or a
+    scipy.sparse-like matrix (anything with a tocoo method). An index is an
+    int or a tuple of ints; the indices of a COO pair are a sequence (or
+    array) with one index per value, or a tuple with one array per dimension
+    (as returned by numpy.nonzero). Elements that aren't given are
+    zero-initialized. Dicts with integer keys and scipy.sparse matrices can
+    also be used as values directly.
+
+    The dimensions of the array are those of the Variable, or shape if the
+    Variable doesn't specify any (scipy.sparse matrices provide it).
+    """
+
+    def __init__(self, entries, shape=None):
+        self.entries = entries
+
+        if shape is None:
+            shape = getattr(entries, 'shape', None)
+        elif not isinstance(shape, AnyArrayValue):
+            shape = [shape]
+        self.shape = shape
+
+    def coo(self):
+        """Return the indices, as an (entries, dimensions) integer ndarray,
+        and the values of the entries."""
+
+        entries = self.entries
+
+        if hasattr(entries, 'tocoo'):
+            coo = entries.tocoo(copy=True)
+
+            if hasattr(coo, 'sum_duplicates'):
+                coo.sum_duplicates()
+            coords = getattr(coo, 'coords', None)
+            indices = tuple(coords if coords is not None else (coo.row,
+                                                               coo.col))
+            values = np.asarray(coo.data)
+        elif isinstance(entries, dict):
+            indices = list(entries.keys())
+            values = list(entries.values())
+        else:
+            indices, values = entries
+
+        if isinstance(indices, tuple):
+            indices = np.stack([np.asarray(axis) for axis in indices], axis=1)
+        else:
+            indices = np.asarray(indices)
+
+        if indices.ndim == 1:
+            indices = indices.reshape(-1, 1)
+        indices = indices.astype(np.int64, copy=False)
+
+        if not isinstance(values, np.ndarray):
+            values = list(values)
+
+        if len(indices) != len(values):
+            raise ValueError("sparse entries need one index per value")
+
+        return indices, values
+
+
+class Struct:
+    """C-style struct class."""
+
+    __slots__ = ('name', 'variables', 'comment', 'typedef')
+
+    def __init__(self, name, typedef=False, comment=None):
+        self.name = name  # definition name of this struct e.g. Struct_t
+        self.variables = []
+        self.comment = comment
+        self.typedef = typedef
+
+    def add_variable(self, variable):
+        """Add another variable to struct."""
+
+        if not isinstance(variable, Variable):
+            raise TypeError("variable must be 'Variable'")
+        self.variables.append(variable)
+
+
+class Modifier(metaclass=ABCMeta):
+    """Abstract base class for initialization modifiers.
+
+    Sometimes we want to initialize a value to another variable, but in some
+    more complicated manner: using the address-of operator, dereference
+    operator, subscripting, typecasting... This is an ABC for those
+    modifiers.
+    """
+
+    __slots__ = ()
+
+    @property
+    @abstractmethod
+    def name(self):
+        """Return a name for initialization."""
+        pass
+
+
+# no modifier is also a modifier!
+Modifier.register(Variable)
+
+
+class AddressOf(Modifier):
+    """Address of (&) modifier for variable initialization."""
+
+    __slots__ = ('target', )
+
+    def __init__(self, target):
+        if not isinstance(target, (Modifier, Function)):
+            raise TypeError("Modifiers can only be used with variables, "
+                            "functions and modifiers.")
+        self.target = target
+
+    @property
+    def name(self):
+        return '&' + self.target.name
+
+
+class Dereference(Modifier):
+    """Dereference (*) modifier for variable initialization."""
+
+    __slots__ = ('target', )
+
+    def __init__(self, target):
+        if not isinstance(target, Modifier):
+            raise TypeError(
+                "Modifiers can only be used with variables and modifiers.")
+        self.target = target
+
+    @property
+    def name(self):
+        return '*' + self.target.name
+
+
+class Typecast(Modifier):
+    """Typecast modifier for variable initialization."""
+
+    __slots__ = ('target', 'cast')
+
+    def __init__(self, target, cast):
+        if not isinstance(target, Modifier):
+            raise TypeError(
+                "Modifiers can only be used with variables and modifiers.")
+        self.target = target
+        self.cast = cast
+
+    @property
+    def name(self):
+        return '(' + self.cast + ')' + self.target.name
+
+
+class Subscript(Modifier):
+    """Subscript ([]) modifier for variable initialization."""
+
+    __slots__ = ('target', 'subscript')
+
+    def __init__(self, target, subscript):
+        if not isinstance(target, Modifier):
+            raise TypeError(
+                "Modifiers can only be used with variables and modifiers.")
+
+        if not isinstance(subscript, (AnyInt, Modifier, AnyArrayValue)):
+            raise TypeError(
+                "Subscript must be an AnyInt, Modifier (or Variable), list or"
+                " tuple.")
+
+        if not subscript:
+            raise TypeError("Subscript must be non-empty.")
+
+        if isinstance(subscript, (AnyInt, Modifier)):
+            self.subscript = [subscript]
+        else:
             self.subscript = subscript
         self.target = target
 
@@ -445,6 +1783,8 @@ class Subscript(Modifier):
 class Dot(Modifier):
     """Dot (.) modifier for variable initialization."""
 
+    __slots__ = ('target', 'item')
+
     def __init__(self, target, item):
         if not isinstance(target, Modifier):
             raise TypeError(
@@ -463,6 +1803,8 @@ class Dot(Modifier):
 class Arrow(Modifier):
     """Arrow (->) modifier for variable initialization."""
 
+    __slots__ = ('target', 'item')
+
     def __init__(self, target, item):
         if not isinstance(target, Modifier):
             raise TypeError(
@@ -484,6 +1826,8 @@ class GenericModifier(Modifier):
     Expects a formatstring that uses {0} to signify variable name.
     """
 
+    __slots__ = ('target', 'formatstring')
+
     def __init__(self, target, formatstring):
         if target and not isinstance(target, Modifier):
             raise TypeError(
@@ -504,6 +1848,8 @@ class OffsetOf(Modifier):
     members.
     """
 
+    __slots__ = ('struct', 'member')
+
     def __init__(self, struct, member):
         if not isinstance(struct, (str, Struct)):
             raise TypeError(
@@ -534,6 +1880,8 @@ class TextModifier(Modifier):
     """Generic modifier that just contains arbitrary text to be used to
     initialize a value."""
 
+    __slots__ = ('text', )
+
     def __init__(self, text):
         self.text = text
 
@@ -549,7 +1897,7 @@ class Function:
         self.name = name
         self.return_type = return_type
         self.variables = []
-        self.code = ''
+        self._code = []  # chunks of the function body, joined on access
         if isinstance(qualifiers, str):
             self.qualifiers = [qualifiers]
         else:
@@ -575,6 +1923,19 @@ class Function:
 
         return prot
 
+    @property
+    def code(self):
+        """Return the body of the function."""
+
+        if len(self._code) > 1:
+            self._code = [''.join(self._code)]
+
+        return self._code[0] if self._code else ''
+
+    @code.setter
+    def code(self, code):
+        self._code = [code]
+
     def add_code(self, code):
         """Add some code to the body of the function."""
 
@@ -587,7 +1948,8 @@ class Function:
         if not isinstance(code, (str, list, CodeWriter)):
             raise TypeError("text must be a 'str', 'list' or a 'CodeWriter'.")
 
-        self.code += code + '\n'
+        self._code.append(code)
+        self._code.append('\n')
 
     def call(self, *arg):
         """Call a function."""
@@ -602,6 +1964,961 @@ class Function:
         return call_
 
 
+# lookup tables
+
+_INTEGER_TYPES = {
+    'int8_t': 'int8',
+    'uint8_t': 'uint8',
+    'int16_t': 'int16',
+    'uint16_t': 'uint16',
+    'int32_t': 'int32',
+    'uint32_t': 'uint32',
+}
+
+
+class LookupTable:
+    """Table of the values of a function, sampled at size evenly spaced points
+    of domain (start, stop).
+
+    function is called once, with a NumPy array of the points. For float and
+    double tables, the values are stored as they are. For the integer types
+    of <stdint.h>, they are quantized to fixed point numbers with
+    fraction_bits fractional bits (Q format); max_error is the largest error
+    of the stored values, and a ValueError is raised if they don't fit.
+
+    CodeWriter.add_lookup_table adds the table (variable) and an inline
+    accessor, <name>_at. For float tables it takes x; for integer tables it
+    takes a position: the index into the table, as a fixed point number with
+    index_bits fractional bits (see position()), so that no floating point is
+    needed at runtime; a ValueError is raised if the positions of the samples
+    don't fit its uint32_t. With interpolate, the accessor interpolates
+    linearly between the samples, otherwise it returns the nearest one.
+    Positions outside of the table are clamped.
+    """
+
+    def __init__(self,
+                 name,
+                 function,
+                 domain,
+                 size,
+                 primitive='float',
+                 fraction_bits=0,
+                 interpolate=True,
+                 index_bits=16,
+                 qualifiers=('static', 'const')):
+        if size < 2:
+            raise ValueError("a lookup table needs at least 2 samples")
+
+        self.name = name
+        self.start, self.stop = (float(bound) for bound in domain)
+
+        if self.start == self.stop:
+            raise ValueError("the domain of a lookup table can't be empty")
+        self.size = size
+        self.primitive = primitive
+        self.interpolate = interpolate
+        self.index_bits = index_bits
+
+        points = np.linspace(self.start, self.stop, size)
+        values = np.broadcast_to(
+            np.asarray(function(points), dtype=np.float64), points.shape)
+
+        if not np.isfinite(values).all():
+            raise ValueError("the function isn't finite on the domain")
+
+        if primitive in ('float', 'double'):
+            self.fraction_bits = None
+            stored = values.astype(
+                np.float32 if primitive == 'float' else np.float64)
+            self.max_error = float(np.abs(stored - values).max())
+            value_opts = '{0:r}f' if primitive == 'float' else None
+        elif primitive in _INTEGER_TYPES:
+            if index_bits < 0:
+                raise ValueError("index_bits can't be negative")
+            # the highest position, plus the rounding to the nearest sample
+            highest = ((size - 1) << index_bits) + (
+                0 if interpolate else (1 << index_bits) >> 1)
+
+            if highest > 0xFFFFFFFF:
+                raise ValueError(
+                    "the positions of {0} samples with {1} index bits don't "
+                    "fit a uint32_t".format(size, index_bits))
+            dtype = np.dtype(_INTEGER_TYPES[primitive])
+            info = np.iinfo(dtype)
+            self.fraction_bits = fraction_bits
+            scaled = np.round(values * 2.0**fraction_bits)
+
+            if scaled.min() < info.min or scaled.max() > info.max:
+                raise ValueError(
+                    "the values don't fit {0} with {1} fractional bits".format(
+                        primitive, fraction_bits))
+            stored = scaled.astype(dtype)
+            self.max_error = float(
+                np.abs(stored / 2.0**fraction_bits - values).max())
+            value_opts = None
+        else:
+            raise ValueError(
+                "primitive must be float, double or one of " +
+                ', '.join(sorted(_INTEGER_TYPES)))
+
+        comment = None
+
+        if self.fraction_bits is not None:
+            comment = 'Q{0}, max error {1:.3g}'.format(fraction_bits,
+                                                       self.max_error)
+        self.variable = Variable(
+            name,
+            primitive,
+            qualifiers=list(qualifiers),
+            comment=comment,
+            value=stored,
+            value_opts=value_opts)
+
+    def position(self, x):
+        """Return the position (fixed point index) of x, for the accessor of
+        integer tables. Positions outside of the table are clamped, so that
+        they fit the uint32_t of the accessor."""
+
+        last = (self.size - 1) << self.index_bits
+        scale = last / (self.stop - self.start)
+
+        return np.clip(
+            np.round((np.asarray(x) - self.start) * scale), 0,
+            last).astype(np.int64)
+
+    def accessor(self, indent='    '):
+        """Return the accessor Function."""
+
+        name = self.name
+        last = self.size - 1
+        func = Function(name + '_at', self.primitive, ['static', 'inline'])
+
+        if self.fraction_bits is None:
+            suffix = 'f' if self.primitive == 'float' else ''
+            scale = last / (self.stop - self.start)
+            func.add_argument(Variable('x', self.primitive))
+            func.add_code([
+                '{0} position = (x - ({1!r}{3})) * {2!r}{3};'.format(
+                    self.primitive, self.start, scale, suffix),
+                'int32_t index;',
+                '',
+                'if (position <= 0)',
+                '{',
+                indent + 'return {0}[0];'.format(name),
+                '}',
+                'if (position >= {0})'.format(last),
+                '{',
+                indent + 'return {0}[{1}];'.format(name, last),
+                '}',
+            ])
+
+            if self.interpolate:
+                func.add_code([
+                    'index = (int32_t)position;',
+                    'return {0}[index] + ({0}[index + 1] - {0}[index]) * '
+                    '(position - index);'.format(name),
+                ])
+            else:
+                func.add_code([
+                    'index = (int32_t)(position + 0.5{0});'.format(suffix),
+                    'return {0}[index];'.format(name),
+                ])
+
+            return func
+
+        bits = self.index_bits
+        func.add_argument(Variable('position', 'uint32_t'))
+
+        if self.interpolate:
+            func.add_code([
+                'uint32_t index = position >> {0};'.format(bits),
+                'int64_t weight = position & {0}u;'.format(2**bits - 1),
+                '',
+                'if (index >= {0})'.format(last),
+                '{',
+                indent + 'return {0}[{1}];'.format(name, last),
+                '}',
+                'return ({0})({1}[index] + ((((int64_t){1}[index + 1] - '
+                '{1}[index]) * weight) >> {2}));'.format(
+                    self.primitive, name, bits),
+            ])
+        else:
+            func.add_code([
+                'uint32_t index = (position + {0}u) >> {1};'.format(
+                    (1 << bits) >> 1, bits),
+                '',
+                'if (index >= {0})'.format(last),
+                '{',
+                indent + 'return {0}[{1}];'.format(name, last),
+                '}',
+                'return {0}[index];'.format(name),
+            ])
+
+        return func
+
+
+# dispatch
+
+DispatchPlan = namedtuple('DispatchPlan', ['strategy', 'reason'])
+DispatchPlan.__doc__ = """Strategy chosen to dispatch cases to handlers.
+
+strategy is 'table' (a dense table of function pointers indexed by the case),
+'binary' (a binary search in sorted tables of cases and handlers) or
+'switch', and reason explains the choice.
+"""
+
+
+def dispatch_strategy(cases, min_density=0.5, min_table=4, min_binary=8):
+    """Return the DispatchPlan of integer cases.
+
+    Cases dense enough (at least min_density of the values between the
+    lowest and the highest one are cases) get a table, if there are at least
+    min_table of them. Otherwise, at least min_binary cases get a binary
+    search, and fewer a switch.
+    """
+
+    cases = sorted(cases)
+
+    if not cases:
+        raise ValueError("there are no cases to dispatch")
+    count = len(cases)
+    span = cases[-1] - cases[0] + 1
+    density = count / span
+    facts = '{0} cases over {1} values (density {2:.2f})'.format(
+        count, span, density)
+
+    if count >= min_table and density >= min_density:
+        return DispatchPlan(
+            'table', '{0}: dense enough for a table (density >= {1}, '
+            'cases >= {2})'.format(facts, min_density, min_table))
+
+    if count >= min_binary:
+        return DispatchPlan(
+            'binary', '{0}: too sparse for a table (density < {1}), too '
+            'many cases for a switch (cases >= {2})'.format(
+                facts, min_density, min_binary))
+
+    return DispatchPlan(
+        'switch', '{0}: too few cases for a table or a binary search '
+        '({1})'.format(
+            facts, 'density < {0}'.format(min_density)
+            if count >= min_table else 'cases < {0}'.format(min_table)))
+
+
+def _handler_name(handler):
+    """Return the name of a handler: a Function, a Modifier or a name."""
+
+    if isinstance(handler, (Function, Modifier)):
+        return handler.name
+
+    if isinstance(handler, str):
+        return handler
+
+    raise TypeError("handlers must be functions, modifiers or names")
+
+
+# words that make up types, not names, at the end of a parameter
+_TYPE_WORDS = frozenset((
+    'void', 'char', 'short', 'int', 'long', 'float', 'double', 'signed',
+    'unsigned', '_Bool', '_Complex', 'const', 'volatile', 'restrict'))
+_TAGS = frozenset(('struct', 'union', 'enum'))
+_QUALIFIERS = frozenset(('const', 'volatile', 'restrict'))
+
+
+def _parameter_type(parameter):
+    """Return the type of a parameter declaration, without its name.
+
+    'char *name' gives 'char *'; bare types, like 'unsigned long' or
+    'struct point', are returned as they are. Array and function pointer
+    parameters aren't supported.
+    """
+
+    tokens = re.findall(r'[A-Za-z_]\w*|\*', parameter)
+
+    if len(tokens) < 2 or tokens[-1] == '*' or tokens[-1] in _TYPE_WORDS:
+        return parameter.strip()
+
+    before = tokens[-2]
+    specifiers = [token for token in tokens[:-1] if token != '*']
+
+    if before in _TAGS or all(token in _QUALIFIERS for token in specifiers):
+        return parameter.strip()
+
+    return parameter[:parameter.rindex(tokens[-1])].strip()
+
+
+# constant pooling
+
+PoolReport = namedtuple(
+    'PoolReport',
+    ['strings', 'unique_strings', 'rows', 'unique_rows', 'size', 'saved'])
+PoolReport.__doc__ = """Statistics of a ConstantPool.
+
+strings counts the strings of its variables and unique_strings the ones in the
+pool, of size bytes; rows counts the rows of its 2-dimensional variables and
+unique_rows the ones emitted. saved is the number of bytes the pooling saves:
+the duplicate strings and rows, less the tables pointing to the rows.
+"""
+
+# byte -> its representation in a C string literal
+_ESCAPES = [
+    chr(byte) if 0x20 <= byte < 0x7f else '\\{0:03o}'.format(byte)
+    for byte in range(256)
+]
+_ESCAPES[ord('"')] = '\\"'
+_ESCAPES[ord('\\')] = '\\\\'
+_ESCAPES[ord('\n')] = '\\n'
+_ESCAPES[ord('\t')] = '\\t'
+_ESCAPES[ord('\r')] = '\\r'
+
+# sizes in bytes of the primitives with a fixed size, besides <stdint.h>'s
+_PRIMITIVE_SIZES = {'char': 1, 'float': 4, 'double': 8}
+
+# ranges of the integer primitives: the minimum ranges guaranteed by C, and
+# the exact ranges of the <stdint.h> types
+_INTEGER_RANGES = {
+    'char': (0, 127),
+    'signed char': (-127, 127),
+    'unsigned char': (0, 255),
+    'short': (-32767, 32767),
+    'unsigned short': (0, 65535),
+    'int': (-32767, 32767),
+    'unsigned': (0, 65535),
+    'unsigned int': (0, 65535),
+    'long': (-2**31 + 1, 2**31 - 1),
+    'unsigned long': (0, 2**32 - 1),
+    'long long': (-2**63 + 1, 2**63 - 1),
+    'unsigned long long': (0, 2**64 - 1),
+    'size_t': (0, 65535),
+}
+_INTEGER_RANGES.update(
+    ('int{0}_t'.format(bits), (-2**(bits - 1), 2**(bits - 1) - 1))
+    for bits in (8, 16, 32, 64))
+_INTEGER_RANGES.update(('uint{0}_t'.format(bits), (0, 2**bits - 1))
+                       for bits in (8, 16, 32, 64))
+
+
+def _primitive_size(primitive, default):
+    """Return the size of a primitive in bytes, or default if it isn't
+    fixed."""
+
+    if re.fullmatch(r'u?int(8|16|32|64)_t', primitive):
+        return np.dtype(primitive[:-2]).itemsize
+
+    return _PRIMITIVE_SIZES.get(primitive, default)
+
+
+def _c_string(data):
+    """Return bytes as the contents of a C string literal (without quotes)."""
+
+    # '??' could start a trigraph
+    return ''.join(_ESCAPES[byte] for byte in data).replace('??', '?\\?')
+
+
+def _nested(values, convert):
+    """Return nested lists of values, each converted."""
+
+    if isinstance(values, list):
+        return [_nested(value, convert) for value in values]
+
+    return convert(values)
+
+
+def _unique_rows(array):
+    """Return the indices of the distinct rows of a 2-dimensional array, in
+    the order they first appear, and the index of each row among them."""
+
+    _, first, inverse = np.unique(
+        array, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    return first[order], rank[inverse.ravel()]
+
+
+class ConstantPool:
+    """Pool of the strings of several variables, each emitted once.
+
+    The variables added to the pool hold (multidimensional) arrays of strings,
+    or 2-dimensional arrays of numbers. CodeWriter.add_constant_pool adds the
+    pool, a char array named name holding each distinct string once, then the
+    variables. Their strings become pointers into the pool (name + offset) if
+    their primitive is a pointer, otherwise the offsets themselves, for a
+    smaller index table of an integer primitive (name + table[i] is the
+    string); a ValueError is raised if they don't fit its range (for the
+    types of <stdint.h>, or the range C guarantees for the other ones).
+    Unlike the strings of other variables, which are written as they are,
+    the strings of the pool are escaped.
+
+    Duplicate rows of 2-dimensional variables (of strings or numbers) are
+    emitted once as well, in <variable>_rows, if that saves memory: the
+    variable becomes a table of pointers to its rows, which is indexed just
+    like the array. pointer_size is the size of a pointer on the target, in
+    bytes.
+    """
+
+    __slots__ = ('name', 'qualifiers', 'pointer_size', 'variables')
+
+    def __init__(self, name, qualifiers=('static', 'const'), pointer_size=4):
+        self.name = name
+        self.qualifiers = list(qualifiers)
+        self.pointer_size = pointer_size
+        self.variables = []
+
+    def add_variable(self, variable):
+        """Add a variable."""
+
+        if not isinstance(variable, Variable):
+            raise TypeError("variable must be of type 'Variable'")
+        self.variables.append(variable)
+
+    def report(self):
+        """Return the PoolReport."""
+
+        return self._layout()[2]
+
+    def _layout(self):
+        """Return the strings of the pool, the variables to render instead of
+        the ones added, and the PoolReport."""
+
+        offsets = {}  # string -> offset in the pool
+        strings = []
+        size = 0
+        string_count = row_count = unique_rows = saved = 0
+        variables = []
+
+        for variable in self.variables:
+            array = np.asarray(variable.value)
+            pointers = '*' in variable.primitive
+
+            if array.dtype.kind in 'US':
+                flat = []
+
+                for string in array.ravel().tolist():
+                    data = string.encode() if isinstance(string,
+                                                         str) else string
+                    offset = offsets.get(data)
+
+                    if offset is None:
+                        offset = offsets[data] = size
+                        strings.append(data)
+                        size += len(data) + 1
+                    else:
+                        saved += len(data) + 1
+                    flat.append(offset)
+                string_count += len(flat)
+                table = np.array(flat, dtype=np.int64).reshape(array.shape)
+
+                if not pointers:
+                    primitive = ' '.join(variable.primitive.split())
+
+                    if primitive not in _INTEGER_RANGES:
+                        raise ValueError(
+                            "the offsets of {0} need an integer primitive, "
+                            "or a pointer".format(variable.name))
+
+                    if flat and max(flat) > _INTEGER_RANGES[primitive][1]:
+                        raise ValueError(
+                            "the offsets of {0} don't fit {1}, the pool is "
+                            "{2} bytes long".format(variable.name, primitive,
+                                                    size))
+            elif array.dtype.kind in 'biuf':
+                if array.ndim != 2:
+                    raise ValueError(
+                        "variables of numbers must be 2-dimensional arrays")
+                table = array
+            else:
+                raise TypeError(
+                    "pooled variables must hold arrays of strings or numbers")
+
+            if pointers and table is not array:
+                modifiers = {
+                    offset: TextModifier('{0} + {1}'.format(self.name, offset))
+                    for offset in set(table.ravel().tolist())
+                }
+                value = _nested(table.tolist(), modifiers.__getitem__)
+            else:
+                value = table if table.ndim else table.item()
+
+            if table.ndim == 2 and len(table) > 1:
+                count, width = table.shape
+                rows, index = _unique_rows(table)
+                rows = rows.tolist()
+                element = (self.pointer_size if pointers else
+                           _primitive_size(variable.primitive,
+                                           table.dtype.itemsize))
+                saving = ((count - len(rows)) * width * element -
+                          count * self.pointer_size)
+                row_count += count
+                unique_rows += len(rows) if saving > 0 else count
+
+                if saving > 0:
+                    saved += saving
+                    rows_name = variable.name + '_rows'
+                    variables.append(
+                        Variable(
+                            rows_name,
+                            variable.primitive,
+                            qualifiers=variable.qualifiers,
+                            value=value[rows] if isinstance(
+                                value, np.ndarray) else
+                            [value[row] for row in rows],
+                            value_opts=variable.value_opts))
+                    value = [
+                        TextModifier('{0}[{1}]'.format(rows_name, row))
+                        for row in index.tolist()
+                    ]
+                    variables.append(
+                        Variable(
+                            variable.name,
+                            variable.primitive + ' *const',
+                            qualifiers=variable.qualifiers,
+                            comment=variable.comment,
+                            value=value))
+
+                    continue
+
+            if table is array:
+                variables.append(variable)
+            else:
+                variables.append(
+                    Variable(
+                        variable.name,
+                        variable.primitive,
+                        qualifiers=variable.qualifiers,
+                        comment=variable.comment,
+                        value=value,
+                        value_opts=variable.value_opts))
+
+        return strings, variables, PoolReport(string_count, len(strings),
+                                              row_count, unique_rows, size,
+                                              saved)
+
+
+# perfect hashing
+
+_FNV_PRIME = 16777619
+_FNV_BASIS = 2166136261
+_MIX_PRIMES = (0x85EBCA6B, 0xC2B2AE35)  # of the MurmurHash3 finalizer
+
+PerfectHash = namedtuple('PerfectHash', ['bases', 'displacements', 'slots'])
+PerfectHash.__doc__ = """Minimal perfect hash of a set of names.
+
+bases are the offset bases of the three 32-bit FNV-1a hashes (h1, h2, h3) of
+a name, each finished by the MurmurHash3 finalizer; displacements has one
+entry per bucket (h1 % len(displacements)) and slots holds the index of the
+name in each slot. With n names, a name
+whose bucket has displacement d is in slot -d - 1 if d is negative, and in
+slot (h2 % n + (d // n) * (h3 % n) + d % n) % n otherwise.
+"""
+
+
+def _fnv_hashes(names, bases):
+    """Return the 32-bit FNV-1a hashes of the UTF-8 encoded names, for each
+    offset basis, as lists.
+
+    The names are laid out in a byte matrix and hashed one column at a time.
+    The low bits of FNV-1a hashes are poorly mixed, so the hashes are
+    finished by the MurmurHash3 finalizer.
+    """
+    data = [name.encode('utf-8') for name in names]
+    lengths = np.array([len(item) for item in data])
+    width = int(lengths.max())
+    matrix = np.frombuffer(
+        b''.join(item.ljust(width, b'\0') for item in data),
+        dtype=np.uint8).reshape(len(data), width)
+    hashes = [np.full(len(data), basis, dtype=np.uint32) for basis in bases]
+    prime = np.uint32(_FNV_PRIME)
+
+    for column in range(width):
+        active = lengths > column
+        byte = matrix[active, column].astype(np.uint32)
+
+        for hashed in hashes:
+            hashed[active] = (hashed[active] ^ byte) * prime
+
+    for hashed in hashes:
+        hashed ^= hashed >> 16
+        hashed *= np.uint32(_MIX_PRIMES[0])
+        hashed ^= hashed >> 13
+        hashed *= np.uint32(_MIX_PRIMES[1])
+        hashed ^= hashed >> 16
+
+    return [hashed.tolist() for hashed in hashes]
+
+
+def _displace(keys, bucket_count):
+    """Return the displacements of the buckets and the slots of the names
+    with the given (bucket, first, second) keys, or None if they can't be
+    placed."""
+    count = len(keys)
+    buckets = [[] for _ in range(bucket_count)]
+
+    for index, (bucket, _, _) in enumerate(keys):
+        buckets[bucket].append(index)
+
+    displacements = [0] * bucket_count
+    slots = [None] * count
+    order = sorted(
+        range(bucket_count), key=lambda bucket: -len(buckets[bucket]))
+    free = list(range(count))  # free slots, in no particular order
+    where = list(range(count))  # index of each free slot in free
+
+    for bucket in order:
+        indices = buckets[bucket]
+
+        if len(indices) < 2:
+            break
+
+        # the names land on starts + offset: try every free slot for the
+        # first one, for each step
+        for step in range(count):
+            starts = [(keys[index][1] + step * keys[index][2]) % count
+                      for index in indices]
+
+            if len(set(starts)) < len(starts):
+                continue
+
+            for position in free:
+                offset = position - starts[0]
+                positions = [(start + offset) % count for start in starts]
+
+                if all(slots[other] is None for other in positions[1:]):
+                    break
+            else:
+                continue
+
+            break
+        else:
+            return None
+
+        for index, position in zip(indices, positions):
+            slots[position] = index
+            last = free.pop()
+
+            if last != position:
+                free[where[position]] = last
+                where[last] = where[position]
+        displacements[bucket] = step * count + offset % count
+
+    for bucket in order:
+        if len(buckets[bucket]) == 1:
+            position = free.pop()
+            slots[position] = buckets[bucket][0]
+            displacements[bucket] = -position - 1
+
+    return displacements, slots
+
+
+def perfect_hash(names, load=4, attempts=32):
+    """Return a PerfectHash of distinct names.
+
+    Names are spread over buckets of (on average) load names by one hash,
+    and the buckets, largest first, get the first displacement that puts
+    their names in free slots (hash and displace). Names alone in their
+    bucket are put in the remaining slots directly. If that fails, other
+    hashes are tried, up to attempts times. Higher loads give fewer
+    displacements, but large buckets are harder to place: above 4 or 5, the
+    search fails more and more often.
+    """
+
+    names = list(names)
+    count = len(names)
+
+    if not count:
+        raise ValueError("there are no names to hash")
+
+    if len(set(names)) != count:
+        raise ValueError("names must be distinct")
+    bucket_count = -(-count // load)
+
+    for attempt in range(attempts):
+        bases = tuple((_FNV_BASIS + 0x9E3779B9 * (3 * attempt + i)) % 2**32
+                      for i in range(3))
+        h1, h2, h3 = _fnv_hashes(names, bases)
+        keys = [(first % bucket_count, second % count, third % count)
+                for first, second, third in zip(h1, h2, h3)]
+
+        if len(set(keys)) != count:
+            continue  # names no displacement can separate
+        placed = _displace(keys, bucket_count)
+
+        if placed is not None:
+            return PerfectHash(bases, *placed)
+
+    raise ValueError("no perfect hash found in {0} attempts".format(attempts))
+
+
+# render caching
+
+
+def _hash_definition(hasher, obj, _active=None):
+    """Feed a deterministic description of a construct or value to hasher."""
+
+    if _active is None:
+        _active = set()
+
+    def feed(*parts):
+        hasher.update(repr(parts).encode('utf-8'))
+
+    if obj is None or isinstance(obj, (bool, int, float, str)) or _is_numpy(
+            obj, 'generic'):
+        feed(type(obj).__name__, repr(obj))
+    elif _is_numpy(obj) and obj.dtype.kind in 'biuf':
+        feed('ndarray', obj.dtype.str, obj.shape)
+        hasher.update(np.ascontiguousarray(obj).data)
+    elif (_is_numpy(obj) and obj.dtype.names is not None
+          and not obj.dtype.hasobject):
+        feed('records', obj.dtype.descr, obj.shape)
+        hasher.update(np.ascontiguousarray(obj).data)
+    elif isinstance(obj, (bytes, bytearray, memoryview, pyarray)):
+        buffer = memoryview(obj)
+        feed(type(obj).__name__, buffer.format, buffer.shape)
+        hasher.update(buffer.tobytes())
+    elif id(obj) in _active:
+        feed('cycle')
+    elif hasattr(obj, 'tocoo'):
+        indices, values = Sparse(obj).coo()
+        feed('sparse', getattr(obj, 'shape', None))
+        _hash_definition(hasher, indices, _active)
+        _hash_definition(hasher, values, _active)
+    elif isinstance(obj, dict):
+        _active.add(id(obj))
+        feed('dict', len(obj))
+
+        for key, value in obj.items():
+            _hash_definition(hasher, key, _active)
+            _hash_definition(hasher, value, _active)
+        _active.discard(id(obj))
+    elif isinstance(obj, AnyArrayValue):
+        _active.add(id(obj))
+        feed(type(obj).__name__, len(obj))
+
+        for value in obj:
+            _hash_definition(hasher, value, _active)
+        _active.discard(id(obj))
+    elif type(obj).__module__ == __name__:
+        _active.add(id(obj))
+        fields = _definition_fields(obj)
+        feed(type(obj).__name__, sorted(fields))
+
+        for name in sorted(fields):
+            _hash_definition(hasher, fields[name], _active)
+
+        if isinstance(obj, Blob) and isinstance(obj.value, (str,
+                                                            os.PathLike)):
+            stat = os.stat(obj.value)
+            feed('file', stat.st_size, stat.st_mtime_ns)
+        _active.discard(id(obj))
+    else:
+        feed(type(obj).__module__, type(obj).__qualname__, repr(obj))
+
+
+def _definition_fields(obj):
+    """Return the attributes defining a csnake object, by name."""
+
+    fields = dict(getattr(obj, '__dict__', {}))
+
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if name != '__weakref__' and hasattr(obj, name):
+                fields[name] = getattr(obj, name)
+
+    # attributes caching derived data don't define anything
+    return {
+        name: value
+        for name, value in fields.items() if not name.endswith('_cache')
+    }
+
+
+class RenderCache:
+    """On-disk memo of rendered constructs.
+
+    Text rendered by CodeWriter for a Variable, Struct or Enum is stored in
+    directory under a hash of the construct's definition, the writer's state
+    and the C-Snake source. A CodeWriter using the cache adds the stored text
+    instead of rendering an unchanged construct again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """Return the key for a construct (and any rendering parameters)."""
+        global _SOURCE_DIGEST
+
+        if _SOURCE_DIGEST is None:
+            with open(__file__, 'rb') as the_file:
+                _SOURCE_DIGEST = sha256(the_file.read()).digest()
+
+        hasher = sha256(_SOURCE_DIGEST)
+
+        for part in parts:
+            _hash_definition(hasher, part)
+
+        return hasher.hexdigest()
+
+    def get(self, key):
+        """Return the text stored under key, or None."""
+
+        try:
+            with open(
+                    os.path.join(self.directory, key),
+                    encoding='utf-8',
+                    newline='') as the_file:
+                text = the_file.read()
+        except FileNotFoundError:
+            self.misses += 1
+
+            return None
+        self.hits += 1
+
+        return text
+
+    def put(self, key, text):
+        """Store text under key."""
+        path = os.path.join(self.directory, key)
+        temp_path = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+
+        with open(temp_path, 'w', encoding='utf-8', newline='') as the_file:
+            the_file.write(text)
+        os.replace(temp_path, path)
+
+
+_SOURCE_DIGEST = None  # hash of this file, salts the RenderCache keys
+
+# (path -> ((size, mtime), digest)) of files known to have some contents
+_FILE_DIGESTS = {}
+
+
+def _file_digest(path, size):
+    """Return the sha256 digest of a file's contents.
+
+    None is returned if the file doesn't exist or isn't size bytes long.
+    Digests are remembered for as long as the file's size and mtime don't
+    change.
+    """
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    if stat.st_size != size:
+        return None
+
+    signature = (stat.st_size, stat.st_mtime_ns)
+    path = os.path.abspath(path)
+    cached = _FILE_DIGESTS.get(path)
+
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    hasher = sha256()
+
+    with open(path, 'rb') as the_file:
+        for block in iter(lambda: the_file.read(1 << 20), b''):
+            hasher.update(block)
+    digest = hasher.digest()
+    _FILE_DIGESTS[path] = (signature, digest)
+
+    return digest
+
+
+def _write_data(file, data, force=False):
+    """Write bytes to a file, unless it already holds them (or force is set).
+
+    Return whether the file was written.
+    """
+    digest = sha256(data).digest()
+
+    if not force and _file_digest(file, len(data)) == digest:
+        return False
+
+    with open(file, 'wb') as the_file:
+        the_file.write(data)
+    stat = os.stat(file)
+    _FILE_DIGESTS[os.path.abspath(file)] = ((stat.st_size,
+                                              stat.st_mtime_ns), digest)
+
+    return True
+
+
+# profiling
+
+ProfileRecord = namedtuple(
+    'ProfileRecord', ['method', 'name', 'seconds', 'size', 'peak_memory'])
+ProfileRecord.__doc__ = """Record of a CodeWriter.add_* call.
+
+method is the name of the add_* method, name the name of the construct (e.g.
+Variable.name), size the number of bytes (UTF-8) it added and peak_memory the
+peak of memory allocated during the call (None unless traced, or if tracing
+was already started by someone else and the call didn't raise its peak).
+"""
+
+
+class Profiler:
+    """Recorder of the add_* calls of the CodeWriters that use it.
+
+    Each call to add_variable_initialization, add_struct, add_enum and the
+    other add_* methods of constructs gets a ProfileRecord with its wall time
+    and the size of its output; with trace_memory, tracemalloc also measures
+    its peak memory allocation (which slows everything down). Hooks are
+    called with every new record.
+    """
+
+    def __init__(self, trace_memory=False, hooks=None):
+        self.trace_memory = trace_memory
+        self.hooks = list(hooks) if hooks else []
+        self.records = []
+
+    def add_hook(self, hook):
+        """Add a function to be called with every new record."""
+        self.hooks.append(hook)
+
+    def record(self, record):
+        """Store a record and pass it to the hooks."""
+        self.records.append(record)
+
+        for hook in self.hooks:
+            hook(record)
+
+    def summary(self, top=10):
+        """Return a report of the totals per method and the slowest calls."""
+        totals = {}
+
+        for record in self.records:
+            total = totals.setdefault(record.method, [0, 0.0, 0])
+            total[0] += 1
+            total[1] += record.seconds
+            total[2] += record.size
+
+        lines = ['{0:<28} {1:>8} {2:>10} {3:>12}'.format(
+            'method', 'calls', 'seconds', 'bytes')]
+
+        for method, (calls, seconds, size) in sorted(
+                totals.items(), key=lambda item: -item[1][1]):
+            lines.append('{0:<28} {1:>8} {2:>10.4f} {3:>12}'.format(
+                method, calls, seconds, size))
+
+        lines.append('')
+        lines.append('{0:<28} {1:<20} {2:>10} {3:>12} {4:>12}'.format(
+            'slowest', 'name', 'seconds', 'bytes', 'peak memory'))
+
+        for record in sorted(
+                self.records, key=lambda record: -record.seconds)[:top]:
+            lines.append('{0:<28} {1:<20} {2:>10.4f} {3:>12} {4:>12}'.format(
+                record.method, str(record.name), record.seconds, record.size,
+                '-' if record.peak_memory is None else record.peak_memory))
+
+        return '\n'.join(lines)
+
+
 # Main, file-generating class
 
 
@@ -612,9 +2929,11 @@ class CodeWriter:
 
     VERSION = "1.1"
 
-    def __init__(self, lf="\n", indent=4):
+    def __init__(self, lf="\n", indent=4, cache=None, profiler=None):
 
         self.line_feed = lf
+        self.cache = cache  # RenderCache for enums, structs and variables
+        self.profiler = profiler  # Profiler recording the add_* calls
 
         if isinstance(indent, AnyInt):
             self.indent = ' ' * indent
@@ -626,7 +2945,22 @@ class CodeWriter:
         self.defs = []  # define levels
         self.switch = []  # switch levels
         self.tabs = 0
-        self.text = ''  # code
+        self._chunks = []  # chunks of code, joined on access
+        self._captures = []  # lists collecting the added text
+        self._profiling = False  # an add_* call is being profiled
+
+    @property
+    def text(self):
+        """Return the generated code."""
+
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+
+        return self._chunks[0] if self._chunks else ''
+
+    @text.setter
+    def text(self, text):
+        self._chunks = [text]
 
     def tab_in(self):
         """Increase tab level."""
@@ -789,49 +3123,503 @@ class CodeWriter:
 
     def add(self, text):
         """Add raw text."""
-        self.text += text
+        self._chunks.append(text)
+
+        for capture in self._captures:
+            capture.append(text)
 
     def add_line(self, text=None, comment=None, ignore_tabs=False):
         """Add a line of (formatted) text."""
 
         # empty line
 
-        if not text and not comment and not self.commenting:
-            self.add(self.line_feed)
+        if not text and not comment and not self.commenting:
+            self.add(self.line_feed)
+
+            return
+
+        if not ignore_tabs and not self.commenting:
+            self.add(self.indent * self.tabs)
+
+        if self.commenting:
+            self.add("* ")
+
+        # add the text (if appropriate)
+
+        if text:
+            self.add(text)
+        # add a trailing comment (if appropriate)
+
+        if comment:
+            if text:
+                self.add(' ')  # add a space after the text
+            self.add('//' + comment)
+
+        self.add(self.line_feed)
+
+    def include(self, file, comment=None):
+        """Add a c-style include."""
+        self.add_line(
+            "#include {file}".format(file=file),
+            comment=comment,
+            ignore_tabs=True)
+
+    def add_enum(self, enum):
+        """Add a constructed enumeration."""
+
+        if not isinstance(enum, Enum):
+            raise TypeError('enum must be of type "Enum"')
+
+        self._render(self._add_enum, enum, cached=True)
+
+    def add_lookup_table(self, table):
+        """Add a LookupTable and its accessor."""
+
+        if not isinstance(table, LookupTable):
+            raise TypeError("table must be of type 'LookupTable'")
+
+        self._render(self._add_lookup_table, table, cached=True)
+
+    def _add_lookup_table(self, table):
+        """Render a lookup table and its accessor."""
+
+        self.add_variable_initialization(table.variable)
+        self.add_line()
+        self.add_function_definition(table.accessor(self.indent))
+
+    def add_dispatch(self,
+                     name,
+                     handlers,
+                     func_ptr,
+                     default=None,
+                     key_type='int',
+                     strategy=None,
+                     fallback='0',
+                     report=False):
+        """Add a function dispatching integer cases to their handlers.
+
+        handlers maps the cases to the handlers (Functions, Modifiers or
+        names), which are all of the type of func_ptr, a FuncPtr. The function
+        name(key_type key, ...) calls the handler of key with its other
+        arguments and returns what it returns; for keys without a handler,
+        default is called if given, otherwise fallback is returned. The
+        arguments of func_ptr may name their parameters ('char *name'); the
+        names are dropped, as the function names its own.
+
+        The handlers are found in a table, a binary search or a switch: the
+        given strategy, or the one chosen by dispatch_strategy. With report,
+        the reason of the choice is added as a comment. The code needs
+        <stddef.h>.
+        """
+
+        if not isinstance(func_ptr, FuncPtr):
+            raise TypeError("func_ptr must be of type 'FuncPtr'")
+
+        for case in handlers:
+            if not isinstance(case, AnyInt):
+                raise TypeError("cases must be integers")
+
+        if strategy is None:
+            plan = dispatch_strategy(handlers)
+        elif strategy in ('table', 'binary', 'switch'):
+            plan = DispatchPlan(strategy, 'chosen by the caller')
+        else:
+            raise ValueError("strategy must be 'table', 'binary' or 'switch'")
+
+        self._render(self._add_dispatch, name, handlers, func_ptr, default,
+                     key_type, plan, fallback, report)
+
+    def _add_dispatch(self, name, handlers, func_ptr, default, key_type, plan,
+                      fallback, report):
+        """Render a dispatching function."""
+
+        args = func_ptr.args or []
+
+        if isinstance(args, str):
+            args = args.split(',')
+        args = [_parameter_type(arg) for arg in args]
+        handler_type = name + '_handler_t'
+        cases = sorted(handlers)
+        names = [_handler_name(handlers[case]) for case in cases]
+        default = _handler_name(default) if default is not None else None
+        indent = self.indent
+
+        func = Function(name, func_ptr.return_type)
+        func.add_argument(Variable('key', key_type))
+
+        for i, arg in enumerate(args):
+            func.add_argument(Variable('arg{0}'.format(i), arg))
+        call = '({0})'.format(', '.join(
+            'arg{0}'.format(i) for i in range(len(args))))
+        void = func_ptr.return_type == 'void'
+
+        def invoke(handler):
+            """Return the lines calling a handler and returning."""
+
+            if void:
+                return [handler + call + ';', 'return;']
+
+            return ['return ' + handler + call + ';']
+
+        otherwise = invoke(default) if default is not None else [
+            'return;' if void else 'return {0};'.format(fallback)
+        ]
+
+        if report:
+            self.add_line(comment='{0}: {1} dispatch, {2}'.format(
+                name, plan.strategy, plan.reason))
+
+        if plan.strategy != 'switch':
+            self.add_line('typedef {0};'.format(
+                func_ptr.get_declaration(handler_type)))
+            self.add_line()
+
+        if plan.strategy == 'table':
+            low = cases[0]
+            span = cases[-1] - low + 1
+            by_case = dict(zip(cases, names))
+            self.add_variable_initialization(
+                Variable(
+                    name + '_table',
+                    handler_type,
+                    qualifiers=['static', 'const'],
+                    value=[
+                        TextModifier(by_case.get(low + i, default or 'NULL'))
+                        for i in range(span)
+                    ]))
+            self.add_line()
+            func.add_code([
+                '{0} handler = NULL;'.format(handler_type),
+                '',
+                'if (key >= {0} && key <= {1})'.format(low, cases[-1]),
+                '{',
+                indent + 'handler = {0}_table[key - ({1})];'.format(
+                    name, low),
+                '}',
+                '',
+                'if (handler != NULL)',
+                '{',
+            ] + [indent + line for line in invoke('handler')] + ['}'] +
+                          otherwise)
+        elif plan.strategy == 'binary':
+            self.add_variable_initialization(
+                Variable(
+                    name + '_keys',
+                    key_type,
+                    qualifiers=['static', 'const'],
+                    value=cases))
+            self.add_variable_initialization(
+                Variable(
+                    name + '_handlers',
+                    handler_type,
+                    qualifiers=['static', 'const'],
+                    value=[TextModifier(handler) for handler in names]))
+            self.add_line()
+            func.add_code([
+                'size_t low = 0;',
+                'size_t high = {0};'.format(len(cases)),
+                '',
+                'while (low < high)',
+                '{',
+                indent + 'size_t middle = low + (high - low) / 2;',
+                '',
+                indent + 'if ({0}_keys[middle] < key)'.format(name),
+                indent + '{',
+                indent * 2 + 'low = middle + 1;',
+                indent + '}',
+                indent + 'else',
+                indent + '{',
+                indent * 2 + 'high = middle;',
+                indent + '}',
+                '}',
+                '',
+                'if (low < {0} && {1}_keys[low] == key)'.format(
+                    len(cases), name),
+                '{',
+            ] + [
+                indent + line
+                for line in invoke('{0}_handlers[low]'.format(name))
+            ] + ['}'] + otherwise)
+        else:
+            lines = ['switch (key)', '{']
+
+            for case, handler in zip(cases, names):
+                lines.append(indent + 'case {0}:'.format(case))
+                lines.extend(indent * 2 + line for line in invoke(handler))
+            lines.append(indent + 'default:')
+            lines.extend(indent * 2 + line for line in otherwise)
+            lines.append('}')
+            func.add_code(lines)
+
+        self.add_function_definition(func)
+
+    def add_constant_pool(self, pool, report=False):
+        """Add a ConstantPool: the pool of strings, then its variables.
+
+        With report, its PoolReport is added as a comment.
+        """
+
+        if not isinstance(pool, ConstantPool):
+            raise TypeError("pool must be of type 'ConstantPool'")
+
+        self._render(self._add_constant_pool, pool, report)
+
+    def _add_constant_pool(self, pool, report):
+        """Render a constant pool."""
+
+        strings, variables, statistics = pool._layout()
+
+        if report:
+            self.add_line(comment=(
+                '{0}: {1.unique_strings} of {1.strings} strings, '
+                '{1.unique_rows} of {1.rows} rows, {1.size} bytes, '
+                '{1.saved} bytes saved'.format(pool.name, statistics)))
+
+        if strings:
+            # the last string is ended by the literal's own null character
+            self.add_line('{0} {1}[{2}] ='.format(
+                ' '.join(pool.qualifiers + ['char']), pool.name,
+                statistics.size))
+            self.tab_in()
+
+            for data in strings[:-1]:
+                self.add_line('"{0}\\0"'.format(_c_string(data)))
+            self.add_line('"{0}";'.format(_c_string(strings[-1])))
+            self.tab_out()
+
+        for variable in variables:
+            self.add_variable_initialization(variable)
+
+    def add_bitset(self, bitset, inline=False):
+        """Add a Bitset, its <NAME>_BITS define and its accessors: macros, or
+        inline functions with inline. The code needs <stdint.h>, and
+        <stddef.h> for the inline functions.
+        """
+
+        if not isinstance(bitset, Bitset):
+            raise TypeError("bitset must be of type 'Bitset'")
+
+        self._render(self._add_bitset, bitset, inline, cached=True)
+
+    def _add_bitset(self, bitset, inline):
+        """Render a bitset and its accessors."""
+
+        self.add_variable_initialization(bitset)
+        self.define(bitset.name.upper() + '_BITS', str(bitset.length))
 
-            return
+        if inline:
+            for func in bitset.accessors():
+                self.add_line()
+                self.add_function_definition(func)
+        else:
+            for name, value in bitset.macros():
+                self.define(name, value)
+
+    def add_enum_lookup(self, enum, name=None):
+        """Add lookup tables and functions for the names of an enumeration.
+
+        <name>_from_name(const char *name, Enum *value) finds the value of a
+        name (without the enum's prefix) with a minimal perfect hash and a
+        single strcmp, returning 0 for unknown names; <name>_to_name(Enum
+        value) returns the name of a value, or NULL: from a dense table, or
+        for sparse values (as chosen by dispatch_strategy), with a binary
+        search in a sorted table or a switch. name defaults to the name of the
+        enum. The values must be integers (or None, for the previous value
+        plus one); of values with several names, the first is used. The code
+        needs <stdint.h>, <stddef.h> and <string.h>.
+        """
 
-        if not ignore_tabs and not self.commenting:
-            self.add(self.indent * self.tabs)
+        if not isinstance(enum, Enum):
+            raise TypeError('enum must be of type "Enum"')
 
-        if self.commenting:
-            self.add("* ")
+        self._render(self._add_enum_lookup, enum, name, cached=True)
 
-        # add the text (if appropriate)
+    def _add_enum_lookup(self, enum, name):
+        """Render the lookup tables and functions of an enumeration."""
 
-        if text:
-            self.add(text)
-        # add a trailing comment (if appropriate)
+        name = name or enum.name
+        enum_type = enum.name if enum.typedef else 'enum ' + enum.name
+        names = [value.name for value in enum.values]
+        numbers = []
+        number = -1
 
-        if comment:
-            if text:
-                self.add(' ')  # add a space after the text
-            self.add('//' + comment)
+        for value in enum.values:
+            if value.value is not None:
+                if not isinstance(value.value, AnyInt):
+                    raise ValueError(
+                        "enum values must be integers to be looked up")
+                number = value.value
+            else:
+                number += 1
+            numbers.append(int(number))
+
+        hashed = perfect_hash(names)
+        count = len(names)
+        by_number = {}
+
+        for value_name, number in zip(names, numbers):
+            by_number.setdefault(number, value_name)
+        sorted_numbers = sorted(by_number)
+        low = sorted_numbers[0]
+        span = sorted_numbers[-1] - low + 1
+        # values of sparse enums are looked up like the cases of a dispatch
+        plan = dispatch_strategy(sorted_numbers, min_table=1)
+        fits_int32 = -2**31 <= low and sorted_numbers[-1] < 2**31
+        number_type = 'int32_t' if fits_int32 else 'int64_t'
+        widest = max(
+            abs(displacement) for displacement in hashed.displacements)
+
+        self.add_variable_initialization(
+            Variable(
+                name + '_keys',
+                'char *const',
+                qualifiers=['static', 'const'],
+                value=[names[index] for index in hashed.slots]))
+        self.add_variable_initialization(
+            Variable(
+                name + '_values',
+                enum_type,
+                qualifiers=['static', 'const'],
+                value=[
+                    TextModifier(enum.prefix + names[index])
+                    for index in hashed.slots
+                ]))
+        self.add_variable_initialization(
+            Variable(
+                name + '_displacements',
+                'int32_t' if widest < 2**31 else 'int64_t',
+                qualifiers=['static', 'const'],
+                value=hashed.displacements))
+
+        if plan.strategy == 'table':
+            self.add_variable_initialization(
+                Variable(
+                    name + '_names',
+                    'char *const',
+                    qualifiers=['static', 'const'],
+                    value=[
+                        by_number.get(low + number, TextModifier('NULL'))
+                        for number in range(span)
+                    ]))
+        elif plan.strategy == 'binary':
+            self.add_variable_initialization(
+                Variable(
+                    name + '_numbers',
+                    number_type,
+                    qualifiers=['static', 'const'],
+                    value=sorted_numbers))
+            self.add_variable_initialization(
+                Variable(
+                    name + '_names',
+                    'char *const',
+                    qualifiers=['static', 'const'],
+                    value=[by_number[number] for number in sorted_numbers]))
+        self.add_line()
 
-        self.add(self.line_feed)
+        indent = self.indent
+        from_name = Function(name + '_from_name', 'int')
+        from_name.add_argument(Variable('name', 'const char *'))
+        from_name.add_argument(Variable('value', enum_type + ' *'))
+        from_name.add_code([
+            'uint32_t h1 = {0}u, h2 = {1}u, h3 = {2}u;'.format(*hashed.bases),
+            'const unsigned char *c;',
+            '{0} displacement;'.format(
+                'int32_t' if widest < 2**31 else 'int64_t'),
+            'uint32_t slot;',
+            '',
+            'for (c = (const unsigned char *)name; *c; c++)',
+            '{',
+            indent + 'h1 = (h1 ^ *c) * {0}u;'.format(_FNV_PRIME),
+            indent + 'h2 = (h2 ^ *c) * {0}u;'.format(_FNV_PRIME),
+            indent + 'h3 = (h3 ^ *c) * {0}u;'.format(_FNV_PRIME),
+            '}',
+        ])
+
+        for variable in ('h1', 'h2', 'h3'):
+            from_name.add_code(
+                '{0} ^= {0} >> 16; {0} *= 0x{1:X}u; {0} ^= {0} >> 13; '
+                '{0} *= 0x{2:X}u; {0} ^= {0} >> 16;'.format(
+                    variable, *_MIX_PRIMES))
+        from_name.add_code([
+            'displacement = {0}_displacements[h1 % {1}u];'.format(
+                name, len(hashed.displacements)),
+            '',
+            'if (displacement < 0)',
+            '{',
+            indent + 'slot = (uint32_t)(-displacement - 1);',
+            '}',
+            'else',
+            '{',
+            indent + 'slot = (uint32_t)((h2 % {0}u + (uint64_t)(displacement '
+            '/ {0}) * (h3 % {0}u) + displacement % {0}) % {0}u);'.format(
+                count),
+            '}',
+            '',
+            'if (strcmp(name, {0}_keys[slot]) != 0)'.format(name),
+            '{',
+            indent + 'return 0;',
+            '}',
+            '*value = {0}_values[slot];'.format(name),
+            'return 1;',
+        ])
+        self.add_function_definition(from_name)
+        self.add_line()
 
-    def include(self, file, comment=None):
-        """Add a c-style include."""
-        self.add_line(
-            "#include {file}".format(file=file),
-            comment=comment,
-            ignore_tabs=True)
+        to_name = Function(name + '_to_name', 'const char *')
+        to_name.add_argument(Variable('value', enum_type))
+
+        if plan.strategy == 'table':
+            to_name.add_code([
+                'long index = (long)value - ({0});'.format(low),
+                '',
+                'if (index < 0 || index >= {0})'.format(span),
+                '{',
+                indent + 'return NULL;',
+                '}',
+                'return {0}_names[index];'.format(name),
+            ])
+        elif plan.strategy == 'binary':
+            to_name.add_code([
+                '{0} number = ({0})value;'.format(number_type),
+                'size_t low = 0;',
+                'size_t high = {0};'.format(len(sorted_numbers)),
+                '',
+                'while (low < high)',
+                '{',
+                indent + 'size_t middle = low + (high - low) / 2;',
+                '',
+                indent + 'if ({0}_numbers[middle] < number)'.format(name),
+                indent + '{',
+                indent * 2 + 'low = middle + 1;',
+                indent + '}',
+                indent + 'else',
+                indent + '{',
+                indent * 2 + 'high = middle;',
+                indent + '}',
+                '}',
+                '',
+                'if (low < {0} && {1}_numbers[low] == number)'.format(
+                    len(sorted_numbers), name),
+                '{',
+                indent + 'return {0}_names[low];'.format(name),
+                '}',
+                'return NULL;',
+            ])
+        else:
+            lines = ['switch (({0})value)'.format(number_type), '{']
 
-    def add_enum(self, enum):
-        """Add a constructed enumeration."""
+            for number in sorted_numbers:
+                lines.append(indent + 'case {0}:'.format(number))
+                lines.append(indent * 2 + 'return "{0}";'.format(
+                    by_number[number]))
+            lines.append(indent + 'default:')
+            lines.append(indent * 2 + 'return NULL;')
+            lines.append('}')
+            to_name.add_code(lines)
+        self.add_function_definition(to_name)
 
-        if not isinstance(enum, Enum):
-            raise TypeError('enum must be of type "Enum"')
+    def _add_enum(self, enum):
+        """Render an enumeration."""
 
         if enum.typedef:
             self.add_line("typedef enum")
@@ -842,7 +3630,7 @@ class CodeWriter:
         for i, v in enumerate(enum.values):
             line = enum.prefix + v.name
 
-            if v.value:
+            if v.value is not None:
                 line += " = " + str(v.value)
 
             if i < (len(enum.values) - 1):
@@ -864,23 +3652,35 @@ class CodeWriter:
         if not isinstance(var, Variable):
             raise TypeError("variable must be of type 'Variable'")
 
+        self._render(self._add_variable_declaration, var, extern)
+
+    def _add_variable_declaration(self, var, extern):
+        """Render a variable declaration."""
+
         self.add_line(var.declaration(extern) + ";", comment=var.comment)
 
-    def add_variable_initialization(self, var):
-        """Add a variable initialization."""
+    def add_variable_initialization(self, var, processes=None):
+        """Add a variable initialization.
+
+        processes is passed on to Variable.iter_initialization.
+        """
 
         if not isinstance(var, Variable):
             raise TypeError("variable must be of type 'Variable'")
 
-        initlines = var.initialization(self.indent).splitlines()
-        self.add_line(initlines[0], comment=var.comment)
+        self._render(
+            self._add_variable_initialization, var, processes, cached=True)
 
-        if len(initlines) > 1:
-            self.tab_in()
+    def _add_variable_initialization(self, var, processes):
+        """Render a variable initialization."""
 
-            for line in initlines[1:]:
-                self.add_line(line)
-            self.tab_out()
+        initlines = var.iter_initialization(self.indent, processes)
+        self.add_line(next(initlines), comment=var.comment)
+        self.tab_in()
+
+        for line in initlines:
+            self.add_line(line)
+        self.tab_out()
 
     def add_struct(self, struct):
         """Add a struct."""
@@ -888,6 +3688,11 @@ class CodeWriter:
         if not isinstance(struct, Struct):
             raise TypeError("struct must be of type 'Struct'")
 
+        self._render(self._add_struct, struct, cached=True)
+
+    def _add_struct(self, struct):
+        """Render a struct."""
+
         if struct.typedef:
             self.add_line("typedef struct")
         else:
@@ -912,6 +3717,11 @@ class CodeWriter:
         if not isinstance(func, Function):
             raise TypeError("func must be of type 'Function'")
 
+        self._render(self._add_function_prototype, func, extern, comment)
+
+    def _add_function_prototype(self, func, extern, comment):
+        """Render a function prototype."""
+
         self.add_line(
             ('extern' if extern else '') + func.prototype() + ';',
             comment=comment)
@@ -922,6 +3732,11 @@ class CodeWriter:
         if not isinstance(func, Function):
             raise TypeError("Argument func must be of type 'Function'")
 
+        self._render(self._add_function_definition, func, comment)
+
+    def _add_function_definition(self, func, comment):
+        """Render a function definition."""
+
         self.add_line(func.prototype(), comment=comment)
         self.open_brace()
 
@@ -940,7 +3755,782 @@ class CodeWriter:
 
         self.add_line(func.call(*arg))
 
-    def write_to_file(self, file):
-        """Write code to file."""
-        with open(file, 'w') as the_file:
-            the_file.write(self.text)
+    def _render(self, render, construct, *args, cached=False):
+        """Call render(construct, *args).
+
+        The call is recorded if the writer has a profiler, and memoized if
+        cached is set and the writer has a cache.
+        """
+
+        if self.profiler is not None and not self._profiling:
+            self._profile(render, construct, *args, cached=cached)
+        elif cached and self.cache is not None:
+            self._cached(render, construct, *args)
+        else:
+            render(construct, *args)
+
+    def _profile(self, render, construct, *args, cached=False):
+        """Call render(construct, *args) and record it with the profiler."""
+        trace_memory = self.profiler.trace_memory
+
+        if trace_memory:
+            import tracemalloc
+        start_tracing = trace_memory and not tracemalloc.is_tracing()
+
+        if start_tracing:
+            tracemalloc.start()
+        # the peak of someone else's tracing is left alone
+        memory, peak = (tracemalloc.get_traced_memory()
+                        if trace_memory else (0, 0))
+
+        self._profiling = True
+        self._captures.append([])
+        start = perf_counter()
+
+        try:
+            self._render(render, construct, *args, cached=cached)
+        finally:
+            seconds = perf_counter() - start
+            captured = self._captures.pop()
+            self._profiling = False
+
+            peak_memory = None
+
+            if trace_memory:
+                peak_after = tracemalloc.get_traced_memory()[1]
+
+                if start_tracing or peak_after > peak:
+                    peak_memory = peak_after - memory
+
+            if start_tracing:
+                tracemalloc.stop()
+
+        self.profiler.record(
+            ProfileRecord(
+                method=render.__name__.lstrip('_'),
+                name=(construct if isinstance(construct, str) else getattr(
+                    construct, 'name', None)),
+                seconds=seconds,
+                size=sum(len(text.encode('utf-8')) for text in captured),
+                peak_memory=peak_memory))
+
+    def _cached(self, render, construct, *args):
+        """Call render(construct, *args), memoized by the cache.
+
+        The text added by render is stored under the definition of construct
+        and the state of the writer that affects the output.
+        """
+        key = self.cache.key(render.__name__, construct, args, self.indent,
+                             self.line_feed, self.tabs, self.commenting)
+        text = self.cache.get(key)
+
+        if text is not None:
+            self.add(text)
+
+            return
+
+        self._captures.append([])
+
+        try:
+            render(construct, *args)
+        finally:
+            captured = self._captures.pop()
+        self.cache.put(key, ''.join(captured))
+
+    def write_to_file(self, file, force=False):
+        """Write code to file.
+
+        Unless force is set, a file which already has the same contents is
+        left untouched, so that its mtime doesn't trigger rebuilds. Return
+        whether the file was written.
+        """
+
+        return _write_data(file, self._encoded(), force)
+
+    def _encoded(self):
+        """Return the code as bytes, as it is written to files."""
+
+        return _encode(self._whole_text())
+
+    def _whole_text(self):
+        """Return all of the generated code."""
+
+        return self.text
+
+
+class StreamingCodeWriter(CodeWriter):
+    """CodeWriter that streams the generated code to a file-like sink.
+
+    Instead of keeping the whole file in memory, completed lines are written
+    to the sink (anything with a write method: an open file, a
+    socket.makefile('w'), ...) as soon as more than buffer_size characters are
+    pending. text only holds the code that hasn't been written yet. Call
+    flush() when done. As the code isn't kept, it can't be written to a file
+    afterwards (with write_to_file or write_files): open the file as the sink
+    instead.
+    """
+
+    def __init__(self, sink, lf="\n", indent=4, buffer_size=65536):
+        super().__init__(lf=lf, indent=indent)
+
+        self.sink = sink
+        self.buffer_size = buffer_size
+        self._pending = 0  # number of buffered characters
+
+    def add(self, text):
+        """Add raw text, writing out completed lines if the buffer is full."""
+        super().add(text)
+        self._pending += len(text)
+
+        if self._pending >= self.buffer_size:
+            self.flush(complete_lines=True)
+
+    def flush(self, complete_lines=False):
+        """Write the buffered code to the sink.
+
+        With complete_lines, a trailing unfinished line is kept in the buffer
+        unless it is the only thing in it.
+        """
+        text = ''.join(self._chunks)
+        tail = ''
+
+        if complete_lines:
+            head, line_feed, tail = text.rpartition(self.line_feed)
+
+            if head or line_feed:
+                text = head + line_feed
+            else:
+                tail = ''
+
+        if text:
+            self.sink.write(text)
+
+        self._chunks = [tail] if tail else []
+        self._pending = len(tail)
+
+    def write_to_file(self, file, force=False):
+        """Raise a TypeError: the code was streamed to the sink."""
+
+        self._whole_text()
+
+    def _whole_text(self):
+        """Raise a TypeError: the code isn't kept."""
+        raise TypeError("the code of a StreamingCodeWriter is streamed to its "
+                        "sink, it can't be written to a file")
+
+
+# multi-file generation
+
+
+class ProjectWriter:
+    """Generator of a header and shards (.c files) defining many variables.
+
+    Variables (or groups of variables which must stay together) are spread
+    over the given number of shards, balancing their number of elements, so
+    that the shards can be compiled in parallel. The header declares all of
+    them extern, and is included by every shard.
+
+    A huge array can also be split along its outermost dimension into parts
+    of equal length (name_part0, name_part1, ...) spread over the shards. They
+    are stitched back together by a table (name) of pointers to their first
+    elements (or rows, of type name_row_t, for multidimensional arrays):
+    element (or row) i of the outermost dimension is
+    name[i / NAME_PART_LENGTH][i % NAME_PART_LENGTH], so that e.g. element
+    [i][j] of a 2-dimensional array is name[i / NAME_PART_LENGTH][i %
+    NAME_PART_LENGTH][j].
+
+    Variables are defined in one file and declared in the header, so they
+    can't be static.
+    """
+
+    def __init__(self,
+                 name,
+                 shards=2,
+                 includes=None,
+                 lf="\n",
+                 indent=4,
+                 cache=None,
+                 profiler=None):
+        if shards < 1:
+            raise ValueError("shards must be positive")
+
+        self.name = name
+        self.shards = shards
+        self.includes = includes or []  # e.g. '<stdint.h>', in the header
+        self.line_feed = lf
+        self.indent = indent
+        self.cache = cache  # RenderCache shared by the writers
+        self.profiler = profiler  # Profiler shared by the writers
+
+        self._units = []  # lists of variables, each defined in one shard
+        # (pointer table, part length, row typedef or None) of split variables
+        self._tables = []
+
+    def add_variable(self, var, split=False):
+        """Add a variable to be defined in a shard.
+
+        With split (True for as many parts as there are shards, or the number
+        of parts), the variable is split into parts which can be defined in
+        different shards.
+        """
+
+        self._check_variable(var)
+
+        if not split:
+            self._units.append([var])
+
+            return
+
+        parts = self.shards if split is True else split
+
+        if not isinstance(parts, AnyInt) or parts < 1:
+            raise ValueError(
+                "split must be True or a positive number of parts")
+
+        if (isinstance(var, Blob) or isinstance(var.primitive, FuncPtr)
+                or not isinstance(var.value, AnyArrayValue)
+                or isinstance(var.value, Sparse)):
+            raise TypeError("only arrays of data can be split")
+
+        dimensions = self._dimensions(var)
+
+        if not dimensions or not dimensions[0]:
+            raise ValueError("only non-empty arrays can be split")
+
+        if dimensions[0] != len(var.value):
+            raise ValueError(
+                "the outermost dimension of the array must be the length of "
+                "the value to split it")
+
+        length = -(-dimensions[0] // parts)  # ceiling division
+        pointers = []
+
+        for i, start in enumerate(range(0, dimensions[0], length)):
+            value = var.value[start:start + length]
+            part = Variable(
+                '{0}_part{1}'.format(var.name, i),
+                var.primitive,
+                qualifiers=var.qualifiers,
+                array=(None if var.array is None else [len(value)] +
+                       list(dimensions[1:])),
+                value=value,
+                value_opts=var.value_opts,
+                compact=var.compact,
+                min_run=var.min_run)
+            self._units.append([part])
+
+            if len(dimensions) > 1:
+                pointers.append(TextModifier(part.name))
+            else:
+                pointers.append(TextModifier('&' + part.name + '[0]'))
+
+        if len(dimensions) > 1:
+            # the parts decay to pointers to their rows
+            row_type = var.name + '_row_t'
+            typedef = 'typedef {0} {1}{2};'.format(
+                var.primitive, row_type,
+                ''.join('[{0}]'.format(d) for d in dimensions[1:]))
+        else:
+            row_type = var.primitive
+            typedef = None
+
+        table = Variable(
+            var.name,
+            row_type + ' *const',
+            qualifiers=var.qualifiers,
+            array=len(pointers),
+            comment=var.comment,
+            value=pointers)
+        self._tables.append((table, length, typedef))
+
+    def add_group(self, variables):
+        """Add variables to be defined together in the same shard."""
+
+        variables = list(variables)
+
+        for var in variables:
+            self._check_variable(var)
+
+        self._units.append(variables)
+
+    @staticmethod
+    def _check_variable(var):
+        """Check that a variable can be defined in a shard."""
+
+        if not isinstance(var, Variable):
+            raise TypeError("variable must be of type 'Variable'")
+
+        qualifiers = var.qualifiers
+
+        if isinstance(qualifiers, str):
+            qualifiers = qualifiers.split()
+
+        if 'static' in (qualifiers or []):
+            raise ValueError("static variables can't be shared by the files")
+
+    @staticmethod
+    def _dimensions(var):
+        """Return the dimensions of a variable, as a list."""
+
+        if var.array is None:
+            return list(shape(var.value))
+
+        if isinstance(var.array, AnyArrayValue):
+            return list(var.array)
+
+        return [var.array]
+
+    def _assign(self):
+        """Return the units of each shard, balancing their elements."""
+
+        def weight(unit):
+            total = 0
+
+            for var in unit:
+                count = 1
+
+                # symbolic dimensions (macros) are of unknown size
+                for dimension in self._dimensions(var):
+                    if isinstance(dimension, AnyInt):
+                        count *= dimension
+                total += count
+
+            return total
+
+        loads = [0] * self.shards
+        assigned = [[] for _ in range(self.shards)]
+        weights = [weight(unit) for unit in self._units]
+
+        for index in sorted(
+                range(len(self._units)), key=lambda i: -weights[i]):
+            shard = loads.index(min(loads))
+            loads[shard] += weights[index]
+            assigned[shard].append(index)
+
+        return [[self._units[index] for index in sorted(indices)]
+                for indices in assigned]
+
+    def _writer(self):
+        return CodeWriter(
+            lf=self.line_feed,
+            indent=self.indent,
+            cache=self.cache,
+            profiler=self.profiler)
+
+    def writers(self):
+        """Return the CodeWriters of the header and the shards, by file name.
+
+        The header (name.h) comes first, followed by the shards (name_0.c,
+        name_1.c, ...).
+        """
+
+        header_name = self.name + '.h'
+        guard = re.sub(r'\W', '_', header_name.upper())
+
+        header = self._writer()
+        header.add_autogen_comment()
+        header.start_if_def(guard, invert=True)
+        header.define(guard)
+        header.add_line()
+
+        for include in self.includes:
+            header.include(include)
+
+        if self.includes:
+            header.add_line()
+
+        for table, length, _ in self._tables:
+            header.define(table.name.upper() + '_PART_LENGTH', str(length))
+
+        if self._tables:
+            header.add_line()
+
+        for _, _, typedef in self._tables:
+            if typedef is not None:
+                header.add_line(typedef)
+
+        if any(typedef is not None for _, _, typedef in self._tables):
+            header.add_line()
+
+        for var in (var for unit in self._units for var in unit):
+            header.add_variable_declaration(var, extern=True)
+
+        for table, _, _ in self._tables:
+            header.add_variable_declaration(table, extern=True)
+        header.add_line()
+        header.end_if_def()
+
+        writers = {header_name: header}
+
+        for i, shard in enumerate(self._assign()):
+            writer = self._writer()
+            writer.add_autogen_comment()
+            writer.include('"{0}"'.format(header_name))
+
+            for var in (var for unit in shard for var in unit):
+                writer.add_line()
+                writer.add_variable_initialization(var)
+
+            if not i:
+                for table, _, _ in self._tables:
+                    writer.add_line()
+                    writer.add_variable_initialization(table)
+            writers['{0}_{1}.c'.format(self.name, i)] = writer
+
+        return writers
+
+    def write_to_directory(self, directory, force=False):
+        """Write the header and the shards to a directory.
+
+        Returns the names of the files that were written (see
+        CodeWriter.write_to_file).
+        """
+
+        writers = self.writers()
+        timings = write_files(
+            [(os.path.join(directory, file_name), writer)
+             for file_name, writer in writers.items()],
+            force=force)
+
+        return [
+            file_name for file_name, timing in zip(writers, timings)
+            if timing.written
+        ]
+
+
+FileTiming = namedtuple('FileTiming',
+                        ['file', 'render_seconds', 'write_seconds', 'size',
+                         'written'])
+FileTiming.__doc__ = """Timing of a file generated by write_files().
+
+render_seconds is the time spent creating (with a factory) and encoding its
+CodeWriter, write_seconds the time spent writing it, size its number of bytes
+and written whether it was written (see CodeWriter.write_to_file).
+"""
+
+
+def _encode(text):
+    """Return code as bytes, as it is written to files."""
+
+    if os.linesep != '\n':
+        text = text.replace('\n', os.linesep)
+
+    import locale
+
+    return text.encode(locale.getpreferredencoding(False))
+
+
+def _render_file(source):
+    """Return the encoded code of a CodeWriter (or of the CodeWriter created
+    by a factory, or of the code itself) and the seconds it took. Runs in the
+    workers of write_files."""
+    start = perf_counter()
+
+    if isinstance(source, str):
+        return _encode(source), perf_counter() - start
+    writer = source if isinstance(source, CodeWriter) else source()
+
+    if not isinstance(writer, CodeWriter):
+        raise TypeError("factories must return a 'CodeWriter'")
+
+    return writer._encoded(), perf_counter() - start
+
+
+def write_files(files,
+                workers=None,
+                processes=False,
+                queue_size=8,
+                force=False):
+    """Generate many files, rendering them concurrently with the writes.
+
+    files is a dict or an iterable of (file, source) pairs, where a source is
+    a CodeWriter or a factory (a callable without arguments) returning one.
+    Factories are called, and the code encoded, in a pool of worker threads,
+    or processes if processes is set (then the factories must be picklable;
+    CodeWriters only send their code). Files are written by a separate thread
+    as soon as they are rendered, in order. At most queue_size files are
+    being rendered or waiting to be written at any time, which bounds the
+    memory held by rendered code.
+
+    Return a list of FileTiming, in the order of files.
+    """
+
+    if queue_size < 1:
+        raise ValueError("queue_size must be positive")
+
+    if isinstance(files, dict):
+        files = files.items()
+
+    rendered = Queue()
+    slots = Semaphore(queue_size)  # released when a file has been written
+    timings = []
+    failures = []
+
+    def write():
+        while True:
+            item = rendered.get()
+
+            if item is None:
+                return
+
+            try:
+                if failures:
+                    continue  # drain the queue
+                file, data, render_seconds = item
+                start = perf_counter()
+
+                try:
+                    written = _write_data(file, data, force)
+                except Exception as error:  # reraised in the calling thread
+                    failures.append(error)
+
+                    continue
+                timings.append(
+                    FileTiming(file, render_seconds, perf_counter() - start,
+                               len(data), written))
+            finally:
+                slots.release()
+
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    writer_thread = Thread(target=write, daemon=True)
+    writer_thread.start()
+
+    try:
+        with executor_class(workers) as executor:
+            pending = deque()
+
+            def put_oldest():
+                file, future = pending.popleft()
+                data, seconds = future.result()
+                rendered.put((file, data, seconds))
+
+            try:
+                for file, source in files:
+                    if failures:
+                        break
+
+                    if processes and isinstance(source, CodeWriter):
+                        source = source._whole_text()
+
+                    # hand rendered files to the writer until one is written
+                    while not slots.acquire(blocking=not pending):
+                        put_oldest()
+                    pending.append((file, executor.submit(_render_file,
+                                                          source)))
+
+                while pending and not failures:
+                    put_oldest()
+            finally:
+                for _, future in pending:
+                    future.cancel()
+    finally:
+        rendered.put(None)
+        writer_thread.join()
+
+    if failures:
+        raise failures[0]
+
+    return timings
+
+
+# command line interface
+
+
+def _load_spec(path):
+    """Load a JSON or (by its extension) TOML spec file."""
+
+    if path.endswith('.toml'):
+        import tomllib
+
+        with open(path, 'rb') as the_file:
+            return tomllib.load(the_file)
+
+    import json
+
+    with open(path) as the_file:
+        return json.load(the_file)
+
+
+def _spec_data(data, base):
+    """Load the data of a variable from a .npy, .npz or raw binary file.
+
+    data is the path of the file, or a dict with the path, the key of the
+    array in a .npz file, and the dtype (default uint8), shape and offset of
+    a raw file.
+    """
+
+    if isinstance(data, str):
+        data = {'path': data}
+    path = os.path.join(base, data['path'])
+
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+
+    if path.endswith('.npz'):
+        with np.load(path) as archive:
+            if 'key' in data:
+                return archive[data['key']]
+
+            if len(archive.files) != 1:
+                raise ValueError(
+                    "{0} holds several arrays, choose one with 'key'".format(
+                        data['path']))
+
+            return archive[archive.files[0]]
+    value = np.fromfile(
+        path, dtype=data.get('dtype', 'uint8'), offset=data.get('offset', 0))
+
+    if 'shape' in data:
+        value = value.reshape(data['shape'])
+
+    return value
+
+
+def _spec_variable(spec, base):
+    """Create the Variable (or Blob) described by a spec."""
+
+    spec = dict(spec)
+
+    if 'blob' in spec:
+        return Blob(data=os.path.join(base, spec.pop('blob')), **spec)
+
+    if 'data' in spec:
+        spec['value'] = _spec_data(spec.pop('data'), base)
+
+    return Variable(**spec)
+
+
+def _spec_writer(spec, base, cache_directory=None):
+    """Create the CodeWriter of a file described by a spec.
+
+    Runs in the workers of main().
+    """
+
+    writer = CodeWriter(
+        cache=RenderCache(cache_directory) if cache_directory else None)
+
+    if spec.get('autogen'):
+        source = spec['autogen']
+        writer.add_autogen_comment(None if source is True else source)
+
+    guard = spec.get('guard')
+
+    if guard:
+        writer.start_if_def(guard, invert=True)
+        writer.define(guard)
+        writer.add_line()
+
+    for include in spec.get('includes', []):
+        writer.include(include)
+
+    for enum_spec in spec.get('enums', []):
+        enum = Enum(
+            enum_spec['name'],
+            prefix=enum_spec.get('prefix', ''),
+            typedef=enum_spec.get('typedef', False))
+
+        for value in enum_spec.get('values', []):
+            if isinstance(value, str):
+                enum.add_value(value)
+            else:
+                enum.add_value(**value)
+        writer.add_line()
+        writer.add_enum(enum)
+
+    for struct_spec in spec.get('structs', []):
+        struct = Struct(
+            struct_spec['name'],
+            typedef=struct_spec.get('typedef', False),
+            comment=struct_spec.get('comment'))
+
+        for variable in struct_spec.get('variables', []):
+            struct.add_variable(_spec_variable(variable, base))
+        writer.add_line()
+        writer.add_struct(struct)
+
+    declarations = spec.get('declarations', [])
+
+    if declarations:
+        writer.add_line()
+
+    for variable in declarations:
+        writer.add_variable_declaration(
+            _spec_variable(variable, base), extern=True)
+
+    for variable in spec.get('variables', []):
+        writer.add_line()
+        writer.add_variable_initialization(_spec_variable(variable, base))
+
+    if guard:
+        writer.add_line()
+        writer.end_if_def()
+
+    return writer
+
+
+def main(argv=None):
+    """Generate the files described by a JSON or TOML spec.
+
+    The spec holds a list of files, each with its path (relative to the
+    spec), and optionally an autogen comment (true or the source to mention),
+    an include guard, includes, enums, structs, extern declarations and
+    variables, generated in that order. Variables take the arguments of
+    Variable, and their value can be loaded from a file with 'data' (see
+    _spec_data); 'blob' makes a Blob of a file. The spec can also set a
+    'cache' directory and a number of 'processes'.
+    """
+    import argparse
+    from functools import partial
+
+    parser = argparse.ArgumentParser(
+        prog='csnake', description=main.__doc__.splitlines()[0])
+    parser.add_argument('spec', help='JSON or TOML (.toml) spec file')
+    parser.add_argument(
+        '--processes',
+        type=int,
+        help='render in this many processes (default: spec or threads)')
+    parser.add_argument('--cache', help='render cache directory')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='write files even if they are unchanged')
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', help='report timings')
+    args = parser.parse_args(argv)
+
+    spec = _load_spec(args.spec)
+    base = os.path.dirname(os.path.abspath(args.spec))
+    processes = args.processes or spec.get('processes')
+    cache_directory = args.cache or spec.get('cache')
+
+    if cache_directory:
+        cache_directory = os.path.join(base, cache_directory)
+
+    files = []
+
+    for file_spec in spec.get('files', []):
+        path = os.path.join(base, file_spec['path'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        files.append((path, partial(_spec_writer, file_spec, base,
+                                    cache_directory)))
+
+    timings = write_files(
+        files,
+        workers=processes,
+        processes=bool(processes and processes > 1),
+        force=args.force)
+
+    if args.verbose:
+        for timing in timings:
+            print('{0}: {1} bytes, rendered in {2:.3f} s, {3}'.format(
+                os.path.relpath(timing.file), timing.size,
+                timing.render_seconds, 'written in {0:.3f} s'.format(
+                    timing.write_seconds) if timing.written else 'unchanged'))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
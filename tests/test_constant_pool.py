@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Tests of ConstantPool."""
+import pytest
+
+import csnake
+
+STRINGS = ['s{0:03}'.format(i) for i in range(100)]  # 500 bytes
+
+
+def pool_of(primitive, value=STRINGS):
+    pool = csnake.ConstantPool('pool')
+    pool.add_variable(csnake.Variable('table', primitive, value=value))
+
+    return pool
+
+
+def test_report():
+    pool = csnake.ConstantPool('pool')
+    pool.add_variable(
+        csnake.Variable('a', 'char *const', value=['x', 'yy', 'x']))
+    pool.add_variable(csnake.Variable('b', 'uint8_t', value=['yy', 'z']))
+
+    assert pool.report() == csnake.PoolReport(
+        strings=5, unique_strings=3, rows=0, unique_rows=0, size=7, saved=5)
+
+
+@pytest.mark.parametrize('primitive', [
+    'uint16_t', 'int16_t', 'uint32_t', 'uint64_t', 'int64_t', 'unsigned int',
+    'long', 'unsigned  long long'
+])
+def test_offsets_fit(primitive):
+    assert pool_of(primitive).report().size == 500
+
+
+@pytest.mark.parametrize('primitive',
+                         ['uint8_t', 'int8_t', 'char', 'unsigned char'])
+def test_offsets_overflow(primitive):
+    with pytest.raises(ValueError):
+        pool_of(primitive).report()
+
+
+@pytest.mark.parametrize('primitive', ['float', 'Index_t'])
+def test_offsets_need_integers(primitive):
+    with pytest.raises(ValueError):
+        pool_of(primitive).report()
+
+
+def test_duplicate_rows():
+    rows = [['a', 'b'], ['c', 'd']] * 4
+    writer = csnake.CodeWriter()
+    pool = pool_of('char *const', rows)
+    writer.add_constant_pool(pool)
+
+    assert pool.report().unique_rows == 2
+    assert 'table_rows[2][2]' in writer.text
+    assert '{table_rows[0], table_rows[1], table_rows[0]' in writer.text
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Tests of the dispatching functions of add_dispatch."""
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import csnake
+from csnake import _parameter_type
+
+PARAMETERS = {
+    'int': 'int',
+    'int x': 'int',
+    'unsigned long': 'unsigned long',
+    'unsigned long count': 'unsigned long',
+    'char *': 'char *',
+    'char *name': 'char *',
+    'const char *name': 'const char *',
+    'int * const p': 'int * const',
+    'size_t': 'size_t',
+    'size_t size': 'size_t',
+    'const point_t': 'const point_t',
+    'struct point': 'struct point',
+    'struct point *p': 'struct point *',
+    ' double  y ': 'double',
+}
+
+
+@pytest.mark.parametrize('parameter, expected', PARAMETERS.items())
+def test_parameter_type(parameter, expected):
+    assert _parameter_type(parameter) == expected
+
+
+@pytest.mark.skipif(shutil.which('gcc') is None, reason="needs gcc")
+@pytest.mark.parametrize('strategy', ['table', 'binary', 'switch'])
+@pytest.mark.parametrize('args', [
+    ['int a', 'const char *text'],
+    'int a, const char *text',
+    ['int', 'const char *'],
+])
+def test_named_arguments(tmp_path, strategy, args):
+    """Named parameters of the FuncPtr give valid C."""
+    writer = csnake.CodeWriter()
+    writer.include('<stddef.h>')
+    writer.include('<string.h>')
+
+    for name, body in (('length', 'return (int)strlen(text);'),
+                       ('plus', 'return a + (int)strlen(text);')):
+        writer.add_line(
+            'static int {0}(int a, const char *text)'.format(name))
+        writer.open_brace()
+        writer.add_line('(void)a;')
+        writer.add_line(body)
+        writer.close_brace()
+    writer.add_dispatch('run', {1: 'length', 3: 'plus'},
+                        csnake.FuncPtr('int', args), fallback='-1',
+                        strategy=strategy)
+    writer.add_line('int main(void)')
+    writer.open_brace()
+    writer.add_line('return !(run(1, 5, "abc") == 3 && '
+                    'run(3, 5, "abc") == 8 && run(2, 5, "abc") == -1);')
+    writer.close_brace()
+
+    source = tmp_path / 'dispatch.c'
+    program = tmp_path / 'dispatch'
+    source.write_text(writer.text)
+    subprocess.run(
+        ['gcc', '-Wall', '-Wextra', '-Werror', '-o',
+         str(program), str(source)],
+        check=True)
+
+    assert subprocess.run([os.fspath(program)]).returncode == 0
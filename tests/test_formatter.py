@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Regression tests: integers formatted with NumPy match str.format."""
+import numpy as np
+import pytest
+
+import csnake
+from csnake import _compile_format
+
+DTYPES = ['int8', 'uint8', 'int16', 'uint16', 'int32', 'uint32', 'int64',
+          'uint64']
+
+# format strings whose integers are formatted with NumPy
+FORMATS = [
+    None, '{0}', '{}', '{0:d}', '{0:x}', '{0:X}', '{0:o}', '{0:b}',
+    '{0:#x}', '{0:#X}', '{0:#o}', '{0:#b}', '0x{0:08X}', '{0:+d}', '{0: d}',
+    '{0:5}', '{0:05}', '{0:+06x}', '{0:#010b}', '{0:3d}u', '({0:#x})',
+    '{0:-4}', 'é{0}ü'
+]
+
+
+def values(dtype):
+    """Return values of a dtype: its limits, small numbers and random ones."""
+    info = np.iinfo(dtype)
+    edges = [info.min, info.min + 1, -1, 0, 1, 9, 10, 15, 16, 255,
+             info.max - 1, info.max]
+    random = np.random.default_rng(0).integers(
+        info.min, info.max, size=200, dtype=dtype, endpoint=True)
+
+    return np.concatenate([
+        np.array([edge for edge in edges if info.min <= edge <= info.max],
+                 dtype=dtype), random
+    ])
+
+
+def expected(formatstring, value):
+    """Return a value formatted by Python."""
+
+    return str(value) if formatstring is None else formatstring.format(value)
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+@pytest.mark.parametrize('formatstring', FORMATS)
+def test_join(formatstring, dtype):
+    block = values(dtype)
+    formatter = _compile_format(formatstring)
+
+    assert formatter._vectorizes(block)
+    assert formatter.join(block) == ', '.join(
+        expected(formatstring, value) for value in block.tolist())
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+@pytest.mark.parametrize('formatstring', FORMATS)
+def test_join_rows(formatstring, dtype):
+    matrix = values(dtype)[:210].reshape(30, 7)
+
+    assert list(_compile_format(formatstring).join_rows(matrix)) == [
+        ', '.join(expected(formatstring, value) for value in row)
+        for row in matrix.tolist()
+    ]
+
+
+@pytest.mark.parametrize('separator', ['', ',', ', ', ',\n    '])
+def test_separators(separator):
+    matrix = values('int16')[:60].reshape(6, 10)
+
+    assert list(_compile_format('{0:#x}').join_rows(matrix, separator)) == [
+        separator.join(format(value, '#x') for value in row)
+        for row in matrix.tolist()
+    ]
+
+
+def test_single_value():
+    block = np.array([-7], dtype=np.int32)
+
+    assert _compile_format('{0:+05}').join(block) == '-0007'
+    assert _compile_format('{0:x}').join(block[:0]) == ''
+
+
+@pytest.mark.parametrize('formatstring', [None, '{0}', '0x{0:08X}', '{0:+d}'])
+@pytest.mark.parametrize('shape', [(50, ), (6, 7), (3, 4, 5)])
+def test_variable(formatstring, shape):
+    """ndarrays are rendered like the same values in lists."""
+    count = int(np.prod(shape))
+    array = values('int32')[:count].reshape(shape)
+
+    def initialization(value):
+        return csnake.Variable(
+            'x', 'int32_t', value=value,
+            value_opts=formatstring).initialization()
+
+    assert initialization(array) == initialization(array.tolist())
+
+
+@pytest.mark.parametrize('value', [
+    [1, -2, 3],
+    [[0, 2**63 - 1], [-2**63, 5]],
+    [2**64 - 1, 0],
+    [2**64, -1],
+    [[[1, 2], [3, 4]], [[5, 6], [7, 8]]],
+])
+@pytest.mark.parametrize('formatstring', [None, '{0:#x}', '{0:c}'])
+def test_int_lists(value, formatstring):
+    """Lists of ints, rendered as ndarrays, look like other lists."""
+    if formatstring == '{0:c}' and not all(
+            0 <= number < 0x110000 for number in np.ravel(value).tolist()):
+        return
+    variable = csnake.Variable('x', 'int', value=value,
+                               value_opts=formatstring)
+    separator = ' = \n' if isinstance(value[0], list) else ' = '
+
+    assert variable.initialization() == (
+        variable.declaration() + separator +
+        ''.join(csnake._iter_array(value, '    ', formatstring)) + ';')
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Tests of LookupTable."""
+import numpy as np
+import pytest
+
+from csnake import LookupTable
+
+
+def table(**options):
+    return LookupTable('t', np.sin, (1, 2), 11, primitive='int16_t',
+                       fraction_bits=14, **options)
+
+
+def lut_position(x):
+    return int(table().position(x))
+
+
+def test_position():
+    lut = table()
+
+    assert lut.position(1.5) == 5 << 16
+    assert lut.position([1, 2]).tolist() == [0, 10 << 16]
+
+
+@pytest.mark.parametrize('x', [0, 0.999, -1e9])
+def test_position_below_start(x):
+    """Positions before the table are clamped to its first sample."""
+
+    assert lut_position(x) == 0
+
+
+@pytest.mark.parametrize('x', [2.001, 3, 1e9])
+def test_position_above_stop(x):
+    """Positions after the table are clamped to its last sample."""
+
+    assert lut_position(x) == 10 << 16
+
+
+def test_reversed_domain():
+    lut = LookupTable('t', np.sin, (2, 1), 11, primitive='int16_t',
+                      fraction_bits=14)
+
+    assert lut.position([2, 1.5, 0, 3]).tolist() == [0, 5 << 16, 10 << 16, 0]
+
+
+@pytest.mark.parametrize('options', [
+    dict(size=100000),
+    dict(size=65537),
+    dict(size=2, index_bits=32),
+    dict(size=11, index_bits=-1),
+    dict(size=11, domain=(1, 1)),
+])
+def test_invalid(options):
+    options = dict(dict(domain=(0, 1), primitive='int16_t', fraction_bits=14),
+                   **options)
+
+    with pytest.raises(ValueError):
+        LookupTable('t', np.sin, **options)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Round-trip tests of perfect_hash and of the generated enum lookups."""
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import csnake
+from csnake import perfect_hash
+
+
+def fnv_hash(name, basis):
+    """Return the finished 32-bit FNV-1a hash of a name, in plain Python."""
+    hashed = basis
+
+    for byte in name.encode('utf-8'):
+        hashed = ((hashed ^ byte) * 16777619) & 0xFFFFFFFF
+    hashed ^= hashed >> 16
+    hashed = (hashed * 0x85EBCA6B) & 0xFFFFFFFF
+    hashed ^= hashed >> 13
+    hashed = (hashed * 0xC2B2AE35) & 0xFFFFFFFF
+
+    return hashed ^ hashed >> 16
+
+
+def slot(hashed, name):
+    """Return the slot of a name, as documented by PerfectHash."""
+    count = len(hashed.slots)
+    h1, h2, h3 = (fnv_hash(name, basis) for basis in hashed.bases)
+    displacement = hashed.displacements[h1 % len(hashed.displacements)]
+
+    if displacement < 0:
+        return -displacement - 1
+
+    return (h2 % count + (displacement // count) * (h3 % count) +
+            displacement % count) % count
+
+
+NAME_SETS = {
+    'one': ['A'],
+    'two': ['A', 'B'],
+    'three': ['', 'a', 'aa'],
+    'prefixes': ['VALUE{0}'.format(i) for i in range(1000)],
+    'unicode': ['\u00e9', 'e\u0301', '\u00fc', '\u00df', '\u540d\u524d',
+                'x' * 100],
+    'words': ['red', 'green', 'blue', 'cyan', 'magenta', 'yellow', 'black'],
+}
+
+
+@pytest.mark.parametrize('names', NAME_SETS.values(), ids=NAME_SETS.keys())
+@pytest.mark.parametrize('load', [1, 2, 4])
+def test_round_trip(names, load):
+    hashed = perfect_hash(names, load=load)
+
+    assert sorted(hashed.slots) == list(range(len(names)))
+    assert [hashed.slots[slot(hashed, name)]
+            for name in names] == list(range(len(names)))
+
+
+def test_invalid_names():
+    with pytest.raises(ValueError):
+        perfect_hash([])
+
+    with pytest.raises(ValueError):
+        perfect_hash(['A', 'B', 'A'])
+
+
+def run_c(tmp_path, writer, declarations, checks):
+    """Compile the code of writer followed by a main function running the
+    checks, and return whether they all passed."""
+    writer.add_line('int main(void)')
+    writer.open_brace()
+
+    for line in declarations + ['int ok = 1;'] + checks:
+        writer.add_line(line)
+    writer.add_line('return !ok;')
+    writer.close_brace()
+
+    source = tmp_path / 'lookup.c'
+    program = tmp_path / 'lookup'
+    source.write_text(writer.text)
+    subprocess.run(
+        ['gcc', '-Wall', '-Wextra', '-Werror', '-o',
+         str(program), str(source)],
+        check=True)
+
+    return subprocess.run([os.fspath(program)]).returncode == 0
+
+
+def lookup_writer(enum):
+    """Return a CodeWriter with an enum and its lookup."""
+    writer = csnake.CodeWriter()
+
+    for header in ('<stddef.h>', '<stdint.h>', '<stdio.h>', '<string.h>'):
+        writer.include(header)
+    writer.add_enum(enum)
+    writer.add_enum_lookup(enum)
+
+    return writer
+
+
+@pytest.mark.skipif(shutil.which('gcc') is None, reason="needs gcc")
+def test_enum_lookup(tmp_path):
+    """The generated C finds every name and value, and no other name."""
+    enum = csnake.Enum('Color_t', prefix='COLOR_', typedef=True)
+    enum.add_values(NAME_SETS['words'], values=[0, 5, None, 0, -3, None, 9])
+    checks = ['ok &= !Color_t_from_name("purple", &value);']
+
+    for name in NAME_SETS['words']:
+        checks.append(
+            'ok &= Color_t_from_name("{0}", &value) && value == COLOR_{0} && '
+            '!strcmp(Color_t_to_name(value), {1});'.format(
+                name, '"{0}"'.format(name) if name != 'cyan' else
+                '"red"'))  # cyan has the value of red, which is named first
+
+    assert run_c(tmp_path, lookup_writer(enum), ['Color_t value;'], checks)
+
+
+# sparse values, looked up with a switch and with a binary search
+SPARSE_VALUES = {
+    'switch': [1, 1 << 24],
+    'binary': [1 << bit for bit in range(0, 30, 3)] + [-5],
+}
+
+
+def sparse_enum(values):
+    enum = csnake.Enum('Flag_t', prefix='FLAG_', typedef=True)
+    enum.add_values(['F{0}'.format(i) for i in range(len(values))],
+                    values=values)
+
+    return enum
+
+
+@pytest.mark.parametrize('values', SPARSE_VALUES.values(),
+                         ids=SPARSE_VALUES.keys())
+def test_sparse_enum_lookup_size(values):
+    """Sparse values don't get a table spanning all of them."""
+
+    assert len(lookup_writer(sparse_enum(values)).text) < 10000
+
+
+@pytest.mark.skipif(shutil.which('gcc') is None, reason="needs gcc")
+@pytest.mark.parametrize('values', SPARSE_VALUES.values(),
+                         ids=SPARSE_VALUES.keys())
+def test_sparse_enum_lookup(tmp_path, values):
+    checks = ['ok &= Flag_t_to_name((Flag_t)2) == NULL;',
+              'ok &= Flag_t_to_name((Flag_t)0) == NULL;']
+
+    for i in range(len(values)):
+        checks.append(
+            'ok &= Flag_t_from_name("F{0}", &value) && value == FLAG_F{0} && '
+            '!strcmp(Flag_t_to_name(value), "F{0}");'.format(i))
+
+    assert run_c(tmp_path, lookup_writer(sparse_enum(values)),
+                 ['Flag_t value;'], checks)